@@ -5,6 +5,7 @@ import importlib
 import os
 import pkgutil
 
+from scripts.lib.profiling import PROFILER
 from scripts.lib.utils import load_yaml_defaults
 
 
@@ -47,6 +48,14 @@ def main():
     parser.add_argument(
         "--config",
     )
+    parser.add_argument(
+        "--profile",
+        help="Save a JSON summary of the time spent per stage and the bytes read and written.",
+    )
+    parser.add_argument(
+        "--trace",
+        help="With --profile, also save every timed stage as a Chrome trace-event file.",
+    )
     subparsers = parser.add_subparsers(dest="command", required=True)
     subparsers_map = load_subparsers(subparsers)
     args, _ = parser.parse_known_args()
@@ -55,8 +64,14 @@ def main():
         subparser = subparsers_map[args.command]
         load_yaml_defaults(subparser, args.config)
     args = parser.parse_args()
-    if hasattr(args, "func"):
-        args.func(args)
+    if args.profile:
+        PROFILER.enable(trace=args.trace is not None)
+    try:
+        if hasattr(args, "func"):
+            args.func(args)
+    finally:
+        if args.profile:
+            PROFILER.dump(args.profile, args.trace)
 
 
 if __name__ == "__main__":
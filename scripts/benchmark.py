@@ -0,0 +1,493 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+import cv2
+import numpy as np
+
+from scripts.calibrate_camera import save_calibration_yaml
+from scripts.estimate_height import detect
+from scripts.estimate_height import estimate_height_from_bbox
+from scripts.estimate_height import estimate_height_from_bbox_v2
+from scripts.estimate_height import estimate_heights_from_bboxes
+from scripts.estimate_height import estimate_person_height_simple
+from scripts.estimate_height import read_camera_parameters
+from scripts.estimate_height import RunOptions
+from scripts.lib.backends import BACKENDS
+from scripts.lib.stream import peak_rss
+from scripts.lib.utils import get_config_parser
+from scripts.lib.utils import load_yaml_defaults
+
+COMMAND_NAME = "benchmark"
+IMAGE_SIZE = (1280, 720)
+# How the memory of a benchmark is measured, saved with the report
+MEMORY_METRICS = {
+    "traced_peak_bytes": "peak of the Python and numpy allocations of one "
+    "steady-state call, traced with tracemalloc after the warm-up call",
+    "rss_peak_growth_bytes": "growth of the peak resident memory of the process "
+    "(ru_maxrss) over the warm-up and timed calls, native allocations of the "
+    "inference backends included, 0 if an earlier benchmark reached a higher peak",
+}
+
+
+def synthetic_cameras(
+    rng: np.random.Generator,
+    num_cameras: int,
+    output_dir: str,
+) -> list[str]:
+    """
+    Writes intrinsics YAML files of random cameras with realistic parameters.
+
+    Args:
+        rng (np.random.Generator): Random generator.
+        num_cameras (int): Number of cameras to generate.
+        output_dir (str): Directory where the intrinsics are saved.
+
+    Returns:
+        list[str]: Paths to the intrinsics files.
+    """
+    width, height = IMAGE_SIZE
+    paths = []
+    for i in range(num_cameras):
+        fx = rng.uniform(0.6, 1.2) * width
+        camera_matrix = np.array(
+            [
+                [fx, 0.0, width / 2 + rng.normal(0, 10)],
+                [0.0, fx * rng.uniform(0.98, 1.02), height / 2 + rng.normal(0, 10)],
+                [0.0, 0.0, 1.0],
+            ],
+        )
+        dist_coeffs = np.array(
+            [rng.normal(0, 0.1), rng.normal(0, 0.05), 0.0, 0.0, rng.normal(0, 0.01)],
+        )
+        path = os.path.join(output_dir, f"cam{i + 1}.yaml")
+        save_calibration_yaml(path, camera_matrix, dist_coeffs, IMAGE_SIZE, (5.7, 3.2))
+        paths.append(path)
+    return paths
+
+
+def draw_person(
+    image: np.ndarray,
+    bbox: list[float],
+    rng: np.random.Generator,
+) -> None:
+    """
+    Draws a standing figure filling `bbox` (head, torso, arms and legs in
+    contrasting colors), so a detector finds a person where the sample box is.
+    """
+    x_min, y_min, x_max, y_max = bbox
+    width, height = x_max - x_min, y_max - y_min
+    center = x_min + width / 2
+    skin = tuple(int(value) for value in rng.integers(120, 230, 3))
+    shirt = tuple(int(value) for value in rng.integers(0, 256, 3))
+    trousers = tuple(int(value) for value in rng.integers(0, 90, 3))
+
+    def point(x: float, y: float) -> tuple[int, int]:
+        return int(round(x)), int(round(y))
+
+    head_radius = 0.065 * height
+    cv2.ellipse(
+        image,
+        point(center, y_min + head_radius),
+        point(head_radius * 0.8, head_radius),
+        0,
+        0,
+        360,
+        skin,
+        -1,
+        cv2.LINE_AA,
+    )
+    shoulders, hips = y_min + 0.15 * height, y_min + 0.52 * height
+    torso = np.array(
+        [
+            point(center - 0.3 * width, shoulders),
+            point(center + 0.3 * width, shoulders),
+            point(center + 0.22 * width, hips),
+            point(center - 0.22 * width, hips),
+        ],
+    )
+    cv2.fillConvexPoly(image, torso, shirt, cv2.LINE_AA)
+    limb = max(2, int(0.09 * width))
+    for side in (-1, 1):
+        cv2.line(
+            image,
+            point(center + side * 0.3 * width, shoulders + limb),
+            point(center + side * 0.45 * width, y_min + 0.5 * height),
+            shirt,
+            limb,
+            cv2.LINE_AA,
+        )
+        cv2.line(
+            image,
+            point(center + side * 0.12 * width, hips),
+            point(center + side * 0.2 * width, y_max - limb / 2),
+            trousers,
+            int(limb * 1.4),
+            cv2.LINE_AA,
+        )
+
+
+def synthetic_samples(
+    rng: np.random.Generator,
+    intrinsics: list[str],
+    num_samples: int,
+    image_dir: str | None = None,
+) -> list[dict]:
+    """
+    Builds random estimation samples (camera pose and person bounding box).
+
+    Args:
+        rng (np.random.Generator): Random generator.
+        intrinsics (list[str]): Intrinsics files the samples are spread over.
+        num_samples (int): Number of samples.
+        image_dir (str): If given, an image of a person in `gt_bbox` is written
+            for every sample.
+    """
+    width, height = IMAGE_SIZE
+    samples = []
+    for i in range(num_samples):
+        box_height = rng.uniform(0.2, 0.8) * height
+        box_width = box_height * rng.uniform(0.25, 0.45)
+        x_min = rng.uniform(0, width - box_width)
+        y_min = rng.uniform(0, height - box_height)
+        bbox = [x_min, y_min, x_min + box_width, y_min + box_height]
+        sample = {
+            "intrinsics": intrinsics[i % len(intrinsics)],
+            "camera_height": float(rng.uniform(1.0, 3.0)),
+            "camera_pitch": float(rng.uniform(-30.0, 0.0)),
+            "camera_yaw": float(rng.uniform(-15.0, 15.0)),
+            "distance": float(rng.uniform(2.0, 15.0)),
+            "gt_bbox": bbox,
+        }
+        if image_dir is not None:
+            image_path = os.path.join(image_dir, f"{i:06d}.png")
+            # Smooth background, so the figure is the most salient object
+            background = rng.integers(60, 200, (2, 2, 3)).astype(np.uint8)
+            image = cv2.resize(background, IMAGE_SIZE, interpolation=cv2.INTER_LINEAR)
+            draw_person(image, bbox, rng)
+            cv2.imwrite(image_path, image)
+            sample["image_path"] = image_path
+        samples.append(sample)
+    return samples
+
+
+def measure(
+    fn: Callable[[], object],
+    ops_per_call: int,
+    repeats: int,
+    summarize: Callable[[Any], dict[str, float]] | None = None,
+) -> dict[str, Any]:
+    """
+    Times `fn` and reports its throughput, latency percentiles and memory (see
+    `MEMORY_METRICS`), all measured after a warm-up call.
+
+    Args:
+        fn (Callable): Function to benchmark, one call processes `ops_per_call` items.
+        ops_per_call (int): Items processed by a call.
+        repeats (int): Number of timed calls.
+        summarize (Callable): Optional statistics of the result of a call, added to the report.
+    """
+    rss_before = peak_rss()
+    # Warm-up call, which fills the caches (cameras, model) and is not reported
+    result = fn()
+    # Memory of a steady-state call, traced apart so the timings are not affected
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies[i] = time.perf_counter() - start
+    rss_after = peak_rss()
+    stats: dict[str, Any] = {
+        "ops_per_sec": ops_per_call * repeats / latencies.sum(),
+        "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+        "p99_ms": float(np.percentile(latencies, 99) * 1e3),
+        "traced_peak_bytes": int(peak),
+        "rss_peak_growth_bytes": (
+            rss_after - rss_before
+            if rss_before is not None and rss_after is not None
+            else None
+        ),
+    }
+    if summarize is not None:
+        stats.update(summarize(result))
+    return stats
+
+
+def count_found(predictions: list[dict]) -> dict[str, float]:
+    """Samples of a `detect()` run where a person was found."""
+    found = sum(sample["pred_height"] is not None for sample in predictions)
+    return {"found": found, "found_ratio": found / max(1, len(predictions))}
+
+
+def quiet(fn: Callable[[], object]) -> Callable[[], object]:
+    """Silences the prints and progress bars of `fn`."""
+
+    def wrapped():
+        with contextlib.redirect_stdout(io.StringIO()):
+            with contextlib.redirect_stderr(io.StringIO()):
+                return fn()
+
+    return wrapped
+
+
+def run_benchmark(
+    num_samples: int = 4096,
+    batch_sizes: tuple[int, ...] = (1, 32, 256),
+    num_cameras: int = 4,
+    repeats: int = 20,
+    model_name: str | None = None,
+    backend: str = "ultralytics",
+    output_file: str | None = None,
+    seed: int = 0,
+) -> dict:
+    """
+    Benchmarks the height estimation hot path on synthetic cameras and boxes.
+
+    Args:
+        num_samples (int): Number of samples used by the full `detect()` runs.
+        batch_sizes (tuple[int]): Batch sizes to benchmark.
+        num_cameras (int): Number of synthetic cameras.
+        repeats (int): Timed calls per benchmark.
+        model_name (str): If given, `detect()` is also benchmarked with this YOLO model.
+        backend (str): Inference backend running the model.
+        output_file (str): Path to save the JSON report.
+        seed (int): Random seed.
+
+    Returns:
+        dict: The report with one result per (benchmark, batch size).
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        intrinsics = synthetic_cameras(rng, num_cameras, tmp_dir)
+        samples = synthetic_samples(rng, intrinsics, num_samples)
+        extrinsics = [read_camera_parameters(sample) for sample in samples]
+        bboxes = np.asarray([sample["gt_bbox"] for sample in samples])
+        K, R, T, C, DC = (np.stack(param) for param in zip(*extrinsics))
+        image_samples = []
+        if model_name is not None:
+            image_dir = os.path.join(tmp_dir, "images")
+            os.makedirs(image_dir)
+            image_samples = synthetic_samples(
+                rng,
+                intrinsics,
+                max(batch_sizes),
+                image_dir,
+            )
+            for sample in image_samples:
+                del sample["gt_bbox"]
+
+        for batch_size in batch_sizes:
+            batch = slice(0, batch_size)
+
+            def per_box(estimate):
+                # Back-projection path, the simple one is timed on its own
+                return lambda: [
+                    estimate(bbox, *params, simple=False)
+                    for bbox, params in zip(bboxes[batch], extrinsics[batch])
+                ]
+
+            benchmarks: dict[str, tuple[Callable[[], object], int]] = {
+                "estimate_person_height_simple": (
+                    lambda: [
+                        estimate_person_height_simple(bbox, k, r, -c[2], dc)
+                        for bbox, (k, r, _, c, dc) in zip(
+                            bboxes[batch],
+                            extrinsics[batch],
+                        )
+                    ],
+                    batch_size,
+                ),
+                "estimate_height_from_bbox": (
+                    per_box(estimate_height_from_bbox),
+                    batch_size,
+                ),
+                "estimate_height_from_bbox_v2": (
+                    per_box(estimate_height_from_bbox_v2),
+                    batch_size,
+                ),
+                "estimate_heights_from_bboxes": (
+                    lambda: estimate_heights_from_bboxes(
+                        bboxes[batch],
+                        K[batch],
+                        R[batch],
+                        T[batch],
+                        C[batch],
+                        DC[batch],
+                    ),
+                    batch_size,
+                ),
+                "detect_gt_bbox": (
+                    quiet(
+                        lambda: detect(
+                            [dict(sample) for sample in samples],
+                            batch_size=batch_size,
+                        ),
+                    ),
+                    num_samples,
+                ),
+            }
+            if model_name is not None:
+                benchmarks["detect_model"] = (
+                    quiet(
+                        lambda: detect(
+                            [dict(sample) for sample in image_samples],
+                            model_name=model_name,
+                            batch_size=batch_size,
+                            options=RunOptions(backend=backend),
+                        ),
+                    ),
+                    len(image_samples),
+                )
+            for name, (fn, ops_per_call) in benchmarks.items():
+                # Whole detect() runs are much slower than a single batch
+                is_detect = name.startswith("detect")
+                runs = max(1, repeats // 10) if is_detect else repeats
+                stats = measure(
+                    fn,
+                    ops_per_call,
+                    runs,
+                    count_found if is_detect else None,
+                )
+                results.append({"name": name, "batch_size": batch_size, **stats})
+                rss_growth = stats["rss_peak_growth_bytes"]
+                print(
+                    f"{name:<32} batch {batch_size:>5}: {stats['ops_per_sec']:>12.1f} ops/s "
+                    f"p50 {stats['p50_ms']:.3f} ms p99 {stats['p99_ms']:.3f} ms "
+                    f"traced peak {stats['traced_peak_bytes'] / 1e6:.2f} MB"
+                    + (
+                        f" RSS +{rss_growth / 1e6:.2f} MB"
+                        if rss_growth is not None
+                        else ""
+                    )
+                    + (f" found {stats['found']}/{ops_per_call}" if is_detect else ""),
+                )
+
+    report = {
+        "config": {
+            "num_samples": num_samples,
+            "batch_sizes": list(batch_sizes),
+            "num_cameras": num_cameras,
+            "repeats": repeats,
+            "model": model_name,
+            "backend": backend,
+            "seed": seed,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "memory": MEMORY_METRICS,
+        },
+        "results": results,
+    }
+    if output_file:
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+        with open(output_file, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"Benchmark report saved to: {output_file}")
+    return report
+
+
+def register_subparser(
+    subparsers: argparse._SubParsersAction,
+) -> argparse.ArgumentParser:
+    """
+    Registers the 'benchmark' subparser for CLI.
+
+    Args:
+        subparsers (argparse._SubParsersAction): The subparsers object from the main parser.
+    """
+    parser = subparsers.add_parser(
+        COMMAND_NAME,
+        help="Benchmark the height estimation hot path on synthetic data.",
+        parents=[get_config_parser()],
+        conflict_handler="resolve",
+    )
+    parser.add_argument(
+        "--num-samples",
+        type=int,
+        default=4096,
+        help="Number of synthetic samples processed by each detect() run.",
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="+",
+        default=[1, 32, 256],
+        help="Batch sizes to benchmark.",
+    )
+    parser.add_argument(
+        "--num-cameras",
+        type=int,
+        default=4,
+        help="Number of synthetic cameras.",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=20,
+        help="Timed calls per benchmark.",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=None,
+        help="YOLO model path, if given detect() is also benchmarked with inference.",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=list(BACKENDS),
+        default="ultralytics",
+        help="Inference backend running --model.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed of the synthetic data.",
+    )
+    parser.add_argument(
+        "--output-file",
+        type=str,
+        default=os.path.join("data", "benchmark.json"),
+        help="Path to save the JSON report.",
+    )
+    parser.set_defaults(
+        func=lambda args: run_benchmark(
+            num_samples=args.num_samples,
+            batch_sizes=tuple(args.batch_sizes),
+            num_cameras=args.num_cameras,
+            repeats=args.repeats,
+            model_name=args.model,
+            backend=args.backend,
+            output_file=args.output_file,
+            seed=args.seed,
+        ),
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Height Estimation Benchmark")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparser = register_subparser(subparsers)
+    # Load defaults into the subparser if config is given
+    args, _ = parser.parse_known_args()
+    if args.config and args.command:
+        load_yaml_defaults(subparser, args.config)
+    args = parser.parse_args()
+    args.func(args)
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import argparse
-import glob
 import os
 
 import cv2
@@ -9,6 +8,11 @@ import numpy as np
 import yaml
 from tqdm import tqdm
 
+from scripts.lib.frame_store import list_frames
+from scripts.lib.frame_store import read_frame
+from scripts.lib.profiling import count
+from scripts.lib.profiling import count_file
+from scripts.lib.profiling import timer
 from scripts.lib.utils import get_config_parser
 from scripts.lib.utils import load_yaml_defaults
 
@@ -97,8 +101,9 @@ def save_calibration_yaml(
     }
 
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    with open(output_file, "w", encoding="utf-8") as f:
+    with timer("write"), open(output_file, "w", encoding="utf-8") as f:
         yaml.dump(data, f, sort_keys=False)
+    count_file("bytes_written", output_file)
 
 
 def calibrate_camera(
@@ -114,19 +119,18 @@ def calibrate_camera(
     Calibrates a camera using images of a chessboard pattern.
 
     Args:
-        input_dir (str): Directory containing calibration images (e.g., extracted frames).
+        input_dir (str): Directory containing calibration PNG images (e.g., extracted frames), or frame store.
         board_width (int): Number of inner corners per chessboard row.
         board_height (int): Number of inner corners per chessboard column.
         square_size (float): Size of the chessboard squares in meters
         fisheye (bool): Flag that tells which camera model to use.
         output_file (str): Directory where the calibration parameters will be saved.
     """
-    if not os.path.isdir(input_dir):
-        raise NotADirectoryError(f"Input directory does not exist: {input_dir}")
+    # Only the PNG images of a directory, as written by extract-frames
+    image_paths = list_frames(input_dir, (".png",))
 
     output_dir = os.path.dirname(output_file)
     os.makedirs(output_dir, exist_ok=True)
-    image_paths = sorted(glob.glob(os.path.join(input_dir, "*.png")))
 
     if not image_paths:
         raise FileNotFoundError("No PNG images found in the input directory.")
@@ -140,41 +144,45 @@ def calibrate_camera(
     imgpoints = []  # 2D points in image plane
 
     for image_path in tqdm(image_paths, desc="Processing frames"):
-        img = cv2.imread(image_path)
+        img = read_frame(image_path)
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-        ret, corners = cv2.findChessboardCorners(
-            gray,
-            (board_width, board_height),
-            None,
-        )
-        if ret:
-            objpoints.append(objp)
-            corners2 = cv2.cornerSubPix(
+        with timer("chessboard_search"):
+            ret, corners = cv2.findChessboardCorners(
                 gray,
-                corners,
-                (11, 11),
-                (-1, -1),
-                criteria=(
-                    cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER,
-                    30,
-                    0.001,
-                ),
+                (board_width, board_height),
+                None,
             )
+        if ret:
+            objpoints.append(objp)
+            with timer("corner_refinement"):
+                corners2 = cv2.cornerSubPix(
+                    gray,
+                    corners,
+                    (11, 11),
+                    (-1, -1),
+                    criteria=(
+                        cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER,
+                        30,
+                        0.001,
+                    ),
+                )
             imgpoints.append(corners2)
+        count("chessboards_found" if ret else "chessboards_missed")
 
     if not objpoints:
         raise RuntimeError("No valid chessboard patterns were found in the images.")
 
     image_size = gray.shape[::-1]
     if not fisheye:
-        ret, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera(
-            objpoints,
-            imgpoints,
-            image_size,
-            None,
-            None,
-        )
+        with timer("calibration"):
+            ret, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera(
+                objpoints,
+                imgpoints,
+                image_size,
+                None,
+                None,
+            )
     else:
         camera_matrix = np.zeros((3, 3))
         dist_coeffs = np.zeros((4, 1))
@@ -182,19 +190,20 @@ def calibrate_camera(
         tvecs = []  # type: ignore
         image_size = gray.shape[::-1]
         objpoints = np.expand_dims(np.asarray(objpoints), -2)
-        ret, _, _, _, _ = cv2.fisheye.calibrate(
-            np.asarray(objpoints),
-            imgpoints,
-            image_size,
-            camera_matrix,
-            dist_coeffs,
-            rvecs,
-            tvecs,
-            cv2.fisheye.CALIB_RECOMPUTE_EXTRINSIC
-            + cv2.fisheye.CALIB_CHECK_COND
-            + cv2.fisheye.CALIB_FIX_SKEW,
-            (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 1e-6),
-        )
+        with timer("calibration"):
+            ret, _, _, _, _ = cv2.fisheye.calibrate(
+                np.asarray(objpoints),
+                imgpoints,
+                image_size,
+                camera_matrix,
+                dist_coeffs,
+                rvecs,
+                tvecs,
+                cv2.fisheye.CALIB_RECOMPUTE_EXTRINSIC
+                + cv2.fisheye.CALIB_CHECK_COND
+                + cv2.fisheye.CALIB_FIX_SKEW,
+                (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 1e-6),
+            )
 
     save_calibration_yaml(
         output_file,
@@ -227,7 +236,7 @@ def register_subparser(
         "--input",
         type=str,
         default=os.path.join("data", "cam1__stream_rgb_frames"),
-        help="Path to the input directory with chessboard images.",
+        help="Path to the input directory with chessboard PNG images, or .frames store.",
     )
     parser.add_argument(
         "--board-width",
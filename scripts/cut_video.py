@@ -4,6 +4,8 @@ import argparse
 import os
 import subprocess
 
+from scripts.lib.profiling import count_file
+from scripts.lib.profiling import timer
 from scripts.lib.utils import get_config_parser
 from scripts.lib.utils import load_yaml_defaults
 
@@ -46,8 +48,11 @@ def cut_video(input_path: str, start_time: str, end_time: str) -> None:
     print(f"Saving to: {output_path}")
 
     try:
-        subprocess.run(cmd, check=True)
+        with timer("ffmpeg"):
+            subprocess.run(cmd, check=True)
         print("Video cut successfully.")
+        count_file("bytes_read", input_path)
+        count_file("bytes_written", output_path)
     except subprocess.CalledProcessError as e:
         print(f"FFmpeg error: {e}")
 
@@ -1,18 +1,61 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
+import itertools
 import json
+import multiprocessing
+import os
+from collections import deque
+from collections.abc import Iterable
+from collections.abc import Iterator
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from dataclasses import replace
 
 import cv2
 import numpy as np
 import tqdm
-from ultralytics import YOLO
 
+from scripts.lib.backends import BACKENDS
+from scripts.lib.backends import InferenceBackend
+from scripts.lib.backends import load_backend
+from scripts.lib.columnar import OUTPUT_FORMATS
+from scripts.lib.columnar import write_columns
+from scripts.lib.detection_cache import CachedSample
+from scripts.lib.detection_cache import detection_cache_summary
+from scripts.lib.detection_cache import DetectionCache
+from scripts.lib.motion import MOTION_METHODS
+from scripts.lib.motion import MotionScreens
+from scripts.lib.motion import predict
+from scripts.lib.pipeline import Pipeline
+from scripts.lib.prefetch import load_image
+from scripts.lib.profiling import count
+from scripts.lib.profiling import count_file
+from scripts.lib.profiling import PROFILER
+from scripts.lib.profiling import timer
+from scripts.lib.stream import AdaptiveBatcher
+from scripts.lib.stream import iter_jsonl
+from scripts.lib.stream import read_checkpoint
+from scripts.lib.stream import write_checkpoint
+from scripts.lib.tracking import MedianFlowTracker
+from scripts.lib.undistort_map import UndistortionMaps
 from scripts.lib.utils import get_config_parser
 from scripts.lib.utils import load_camera_parameters
+from scripts.lib.utils import load_extrinsics
 from scripts.lib.utils import load_yaml_defaults
+from scripts.lib.utils import LRUCache
+from scripts.lib.video import iter_frames
+from scripts.lib.video import VIDEO_DECODERS
 
 COMMAND_NAME = "estimate-height"
+# Parsed intrinsics keyed by path and mtime, camera models also keyed by extrinsics
+INTRINSICS_CACHE = LRUCache(maxsize=16)
+CAMERA_CACHE = LRUCache(maxsize=1024)
+# Dense undistortion lookup tables, only used once enabled
+UNDISTORTION_MAPS = UndistortionMaps()
 
 
 def build_rotation_matrix(angle_x_deg, angle_y_deg):
@@ -41,6 +84,25 @@ def build_rotation_matrix(angle_x_deg, angle_y_deg):
     return R
 
 
+def undistort_points(pts, K, DC):
+    """
+    Drop-in for `cv2.undistortPoints(pts, K, DC, P=K)` that gathers from the
+    camera undistortion map when one is enabled.
+    Args:
+        pts (np.ndarray): (N, 1, 2) distorted pixel coordinates
+        K (np.ndarray): camera intrinsic matrix (3x3)
+        DC (np.ndarray): OpenCV distortion coefficients
+
+    Returns:
+        (N, 1, 2) undistorted pixel coordinates
+    """
+    undistortion_map = UNDISTORTION_MAPS.get(K, DC) if DC is not None else None
+    with timer("undistortion"):
+        if undistortion_map is None:
+            return cv2.undistortPoints(pts, K, DC, P=K)
+        return undistortion_map.undistort(pts).reshape(-1, 1, 2)
+
+
 def estimate_person_height_simple(
     bbox,
     K,
@@ -75,12 +137,7 @@ def estimate_person_height_simple(
         dtype=np.float32,
     )
 
-    undistorted = cv2.undistortPoints(
-        pts,
-        K,
-        distortion_coeffs,
-        P=K,
-    )
+    undistorted = undistort_points(pts, K, distortion_coeffs)
 
     y_top = undistorted[0, 0, 1]
     y_bottom = undistorted[1, 0, 1]
@@ -115,8 +172,8 @@ def estimate_height_from_bbox_v2(bbox, K, R, T, C, DC, simple: bool = True):
     x_center = (x_min + x_max) / 2
     foot_2d = np.asarray([[x_center, y_max]])[:, np.newaxis, :]
     head_2d = np.asarray([[x_center, y_min]])[:, np.newaxis, :]
-    foot_2d = cv2.undistortPoints(foot_2d, K, DC, P=K).flatten()
-    head_2d = cv2.undistortPoints(head_2d, K, DC, P=K).flatten()
+    foot_2d = undistort_points(foot_2d, K, DC).flatten()
+    head_2d = undistort_points(head_2d, K, DC).flatten()
     foot_2d = np.append(foot_2d, 1.0)
     head_2d = np.append(head_2d, 1.0)
     inv_K = np.linalg.inv(K)
@@ -161,6 +218,107 @@ def estimate_height_from_bbox(bbox, K, R, T, C, DC, simple: bool = True):
     return np.linalg.norm(foot_3d - head_3d)
 
 
+def undistort_bbox_endpoints(bboxes, K, DC):
+    """
+    Undistorts the head (top-center) and foot (bottom-center) points of a set of
+    bounding boxes that share the same camera in a single OpenCV call.
+    Args:
+        bboxes (np.ndarray): (N, 4) array of (x_min, y_min, x_max, y_max)
+        K (np.ndarray): camera intrinsic matrix (3x3)
+        DC (np.ndarray): OpenCV distortion coefficients
+
+    Returns:
+        head, foot: (N, 2) arrays with the undistorted pixel coordinates
+    """
+    # Filled in place, stacking costs more than the undistortion of a few boxes
+    pts = np.empty((2, len(bboxes), 2), dtype=np.float32)
+    pts[:, :, 0] = (bboxes[:, 0] + bboxes[:, 2]) / 2
+    pts[0, :, 1] = bboxes[:, 1]
+    pts[1, :, 1] = bboxes[:, 3]
+    undistorted = undistort_points(pts.reshape(-1, 1, 2), K, DC)
+    head, foot = undistorted.reshape(2, -1, 2)
+    return head, foot
+
+
+def group_by_camera(Ks, DCs):
+    """
+    Groups samples that share the same intrinsics and distortion coefficients.
+    Args:
+        Ks (np.ndarray): (N, 3, 3) stacked camera matrices
+        DCs (np.ndarray): (N, D) stacked distortion coefficients
+
+    Returns:
+        list of index arrays, one per distinct camera
+    """
+    if len(Ks) == 1 or ((Ks == Ks[0]).all() and (DCs == DCs[0]).all()):
+        # Single camera (always the case for a single sample or a video), no sorting
+        return [np.arange(len(Ks))]
+    keys = np.concatenate([Ks.reshape(len(Ks), -1), DCs.reshape(len(DCs), -1)], axis=1)
+    _, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    return [np.flatnonzero(inverse == g) for g in range(inverse.max() + 1)]
+
+
+def estimate_heights_from_bboxes(bboxes, Ks, Rs, Ts, Cs, DCs, simple: bool = True):
+    """
+    Vectorized counterpart of `estimate_height_from_bbox` for a whole batch.
+    Args:
+        bboxes (np.ndarray): (N, 4) array of (x_min, y_min, x_max, y_max)
+        Ks (np.ndarray): (N, 3, 3) camera intrinsic matrices
+        Rs (np.ndarray): (N, 3, 3) rotation matrices
+        Ts (np.ndarray): (N, 3) camera translations
+        Cs (np.ndarray): (N, 3) camera centers
+        DCs (np.ndarray): (N, D) OpenCV distortion coefficients
+        simple (bool): Whether to use the pinhole approximation
+
+    Returns:
+        heights: (N,) estimated heights in meters
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    Ks = np.asarray(Ks, dtype=np.float64)
+    Rs = np.asarray(Rs, dtype=np.float64)
+    Cs = np.asarray(Cs, dtype=np.float64)
+    DCs = np.asarray(DCs)
+    if len(bboxes) == 0:
+        return np.empty(0, dtype=np.float64)
+    if simple:
+        groups = group_by_camera(Ks, DCs)
+        if len(groups) == 1:
+            # Without gathering and scattering by camera, as for a single frame
+            head, foot = undistort_bbox_endpoints(bboxes, Ks[0], DCs[0])
+            y_top = head[:, 1].astype(np.float64)
+            y_bottom = foot[:, 1].astype(np.float64)
+        else:
+            y_top = np.empty(len(bboxes))
+            y_bottom = np.empty(len(bboxes))
+            # One undistortion call per distinct camera
+            for idx in groups:
+                head, foot = undistort_bbox_endpoints(
+                    bboxes[idx],
+                    Ks[idx[0]],
+                    DCs[idx[0]],
+                )
+                y_top[idx] = head[:, 1]
+                y_bottom[idx] = foot[:, 1]
+        pixel_height = np.abs(y_bottom - y_top)
+        return pixel_height * -Cs[:, 2] / Ks[:, 1, 1] * Rs[:, 1, 1]
+    x_center = (bboxes[:, 0] + bboxes[:, 2]) / 2
+    ones = np.ones(len(bboxes))
+    # (N, 3, 2): foot and head homogeneous points as columns
+    pts = np.stack(
+        [
+            np.stack([x_center, bboxes[:, 3], ones], axis=-1),
+            np.stack([x_center, bboxes[:, 1], ones], axis=-1),
+        ],
+        axis=-1,
+    )
+    # Single batched product: R.T @ inv(K) @ [foot, head]
+    rays = np.transpose(Rs, (0, 2, 1)) @ np.linalg.inv(Ks) @ pts
+    foot_ray, head_ray = rays[..., 0], rays[..., 1]
+    s = -Cs[:, 2] / foot_ray[:, 2]
+    return np.linalg.norm(s[:, np.newaxis] * (foot_ray - head_ray), axis=-1)
+
+
 def get_camera_matrix(intrinsics_path):
     calib = load_camera_parameters(intrinsics_path)
     K = np.array(calib["camera_matrix"], dtype=np.float32)
@@ -168,63 +326,531 @@ def get_camera_matrix(intrinsics_path):
     return K, DC
 
 
-def read_camera_parameters(data: dict):
-    K, DC = get_camera_matrix(data["intrinsics"])
-    h = data["camera_height"]
-    theta_deg = data["camera_pitch"]
-    yaw_deg = data.get("camera_yaw", 0.0)
-    d = data["distance"]
+def read_camera_matrix(intrinsics_path, mtime):
+    K, DC = INTRINSICS_CACHE.get_or_set(
+        (intrinsics_path, mtime),
+        lambda: get_camera_matrix(intrinsics_path),
+    )
+    return K, DC
+
+
+def build_camera_parameters(intrinsics_path, mtime, h, theta_deg, yaw_deg, d):
+    K, DC = read_camera_matrix(intrinsics_path, mtime)
     R = build_rotation_matrix(theta_deg, yaw_deg)
     # Camera translation (camera looking toward +Z, from above the ground and behind the subject)
     # Basically translating the camera down (to the ground), and towards the object
     C = np.array([0, h, -d], dtype=np.float32)
     T = -R @ C
-    return K, R, T, C, DC
+    params = (K, R, T, C, DC)
+    # Shared between samples through the cache, so they must not be modified
+    for param in params:
+        param.flags.writeable = False
+    return params
+
+
+def read_camera_parameters(data: dict):
+    intrinsics_path = data["intrinsics"]
+    extrinsics = (
+        data["camera_height"],
+        data["camera_pitch"],
+        data.get("camera_yaw", 0.0),
+        data["distance"],
+    )
+    key = (intrinsics_path, os.path.getmtime(intrinsics_path), *extrinsics)
+    params = CAMERA_CACHE.get_or_set(key, lambda: build_camera_parameters(*key))
+    K, _, _, _, DC = params
+    UNDISTORTION_MAPS.register(intrinsics_path, K, DC)
+    return params
+
+
+def detect_people(
+    images: list[cv2.typing.MatLike],
+    model: InferenceBackend,
+    motion: MotionScreens | None = None,
+    cameras: list[str] | None = None,
+) -> list[np.ndarray]:
+    """
+    Runs the detector over a batch of images.
+    Args:
+        images (list): Decoded images
+        model (InferenceBackend): Detection model
+        motion (MotionScreens): Optional screen skipping the images where nothing moves
+        cameras (list[str]): Camera of every image, for the motion screen
+
+    Returns:
+        list of (M, 6) float32 arrays with [x_min, y_min, x_max, y_max, cls, conf]
+        of the person detections of each image
+    """
+    predictions = predict(model, images, motion, cameras)
+    return [
+        prediction.boxes[prediction.boxes[:, 4].astype(int) == 0]
+        for prediction in predictions
+    ]
+
+
+def select_person_index(detections: np.ndarray, min_conf: float = 0.75):
+    """Index of the detection of the tallest confident person, None if there is none."""
+    confident = np.flatnonzero(detections[:, 5] > min_conf)
+    if len(confident) == 0:
+        return None
+    heights = detections[confident, 3] - detections[confident, 1]
+    return int(confident[np.argmax(heights)])
+
+
+def select_person(detections: np.ndarray, min_conf: float = 0.75):
+    """Chooses the detection of the tallest confident person, None if there is none."""
+    index = select_person_index(detections, min_conf)
+    return detections[index] if index is not None else None
+
+
+def select_person_bbox(detections: np.ndarray, min_conf: float = 0.75):
+    """Chooses the tallest confident person (bounding box with largest height in pixels)."""
+    person = select_person(detections, min_conf)
+    return person[:4] if person is not None else None
 
 
 def batch_detect_and_estimate(
-    data: list[cv2.typing.MatLike],
-    model: YOLO | None = None,
+    data: list[dict],
+    model: InferenceBackend | None = None,
     simple: bool = True,
+    images: list[cv2.typing.MatLike] | None = None,
+    detections: list[np.ndarray] | None = None,
 ):
-    images = list(map(lambda x: cv2.imread(x["image_path"]), data))
     extrinsics = list(map(read_camera_parameters, data))
-    if model is not None:
-        results = model(images, verbose=False)
-        for i, result in enumerate(results):
-            person_bboxes = [
-                box
-                for box, cls, conf in zip(
-                    result.boxes.xyxy.cpu().numpy(),
-                    result.boxes.cls.cpu().numpy(),
-                    result.boxes.conf.cpu().numpy(),
-                )
-                if int(cls) == 0 and float(conf) > 0.75
-            ]
-        # Choose tallest person (bounding box with largest height in pixels)
-        bbox = max(person_bboxes, key=lambda b: b[3] - b[1])
-        height = estimate_height_from_bbox(bbox, *extrinsics[i], simple=simple)
-        data[i]["pred_height"] = height
+    if detections is None and model is not None:
+        if images is None:
+            images = list(map(load_image, data))
+        detections = detect_people(images, model)
+    people = None
+    if detections is not None:
+        people = [select_person(detected) for detected in detections]
+        bboxes = [person[:4] if person is not None else None for person in people]
     else:
-        for i, sample in enumerate(data):
-            bbox = sample["gt_bbox"]
-            height = estimate_height_from_bbox(bbox, *extrinsics[i], simple=simple)
-            data[i]["pred_height"] = height
+        bboxes = [sample["gt_bbox"] for sample in data]
+    found = [i for i, bbox in enumerate(bboxes) if bbox is not None]
+    K, R, T, C, DC = (np.stack(param) for param in zip(*extrinsics))
+    with timer("geometry"):
+        heights = estimate_heights_from_bboxes(
+            np.asarray([bboxes[i] for i in found]),
+            K[found],
+            R[found],
+            T[found],
+            C[found],
+            DC[found],
+            simple=simple,
+        )
+    for i in range(len(data)):
+        data[i]["pred_height"] = None
+    for i, height in zip(found, heights.tolist()):
+        data[i]["pred_height"] = height
+    if people is not None:
+        # Detection the height was measured on
+        for sample, person in zip(data, people):
+            sample["pred_bbox"] = person[:4].tolist() if person is not None else None
+            sample["pred_conf"] = float(person[5]) if person is not None else None
     return data
 
 
+@dataclass
+class RunOptions:
+    """
+    Execution settings of a height estimation run, they do not change the output.
+
+    Attributes:
+        decode_workers: Threads decoding the images of a batch.
+        pipeline_depth: Batches allowed to wait between two pipeline stages.
+        detection_cache_dir: Directory caching the detections across runs.
+        detection_cache_size: Maximum size of the detection cache in MB.
+        workers: Processes sharing the batches, each with its own model.
+        undistort_map_step: Grid step in pixels of the undistortion lookup tables,
+            None to always use cv2.undistortPoints.
+        backend: Inference backend running the model, one of `BACKENDS`.
+        target_batch_latency: Seconds a batch should take, the batch size then
+            adapts to it (see `AdaptiveBatcher`), None for a fixed batch size.
+        max_rss: Resident memory in MB above which dynamic batches shrink.
+        motion_screen: `mog2` or `diff` to skip the detector on the images where
+            nothing moved since the previous image of the camera, None to detect on all.
+        motion_crop: Whether the detector only sees the moving region of the images.
+    """
+
+    decode_workers: int = 4
+    pipeline_depth: int = 2
+    detection_cache_dir: str | None = None
+    detection_cache_size: float = 1024
+    workers: int = 1
+    undistort_map_step: float | None = None
+    backend: str = "ultralytics"
+    target_batch_latency: float | None = None
+    max_rss: float | None = None
+    motion_screen: str | None = None
+    motion_crop: bool = False
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> RunOptions:
+        return cls(
+            decode_workers=args.decode_workers,
+            pipeline_depth=args.pipeline_depth,
+            detection_cache_dir=args.detection_cache,
+            detection_cache_size=args.detection_cache_size,
+            workers=args.workers,
+            undistort_map_step=args.undistort_map_step,
+            backend=args.backend,
+            target_batch_latency=args.dynamic_batch,
+            max_rss=args.max_rss,
+            motion_screen=args.motion_screen,
+            motion_crop=args.motion_crop,
+        )
+
+    def batcher(self, records: Iterable[dict], batch_size: int) -> AdaptiveBatcher:
+        """Groups the records in batches of `batch_size`, or of a dynamic size."""
+        return AdaptiveBatcher(
+            records,
+            batch_size,
+            target_latency=self.target_batch_latency,
+            max_rss=self.max_rss * 1e6 if self.max_rss is not None else None,
+        )
+
+
 def main(args: argparse.Namespace):
+    options = RunOptions.from_args(args)
+    if not args.input_json and args.video and args.detect_every > 1:
+        track_video(
+            video_path=args.video,
+            intrinsics=args.intrinsics,
+            extrinsics=args.extrinsics,
+            output_file=args.output_file,
+            model_name=args.model,
+            detect_every=args.detect_every,
+            rate=args.rate,
+            options=options,
+            output_format=args.output_format,
+            decoder=args.video_decoder,
+        )
+        return
+    if not args.input_json and args.video:
+        detect_video(
+            video_path=args.video,
+            intrinsics=args.intrinsics,
+            extrinsics=args.extrinsics,
+            output_file=args.output_file,
+            model_name=args.model,
+            batch_size=args.batch_size,
+            rate=args.rate,
+            options=options,
+            output_format=args.output_format,
+            decoder=args.video_decoder,
+        )
+        return
+    if args.input_json.endswith(".jsonl"):
+        if args.output_format != "json":
+            raise ValueError("JSONL inputs are streamed to a JSONL output file")
+        detect_stream(
+            input_file=args.input_json,
+            output_file=args.output_file,
+            model_name=args.model,
+            batch_size=args.batch_size,
+            resume=not args.no_resume,
+            options=options,
+        )
+        return
     with open(args.input_json, encoding="utf-8") as file:
         data = json.load(file)
     if not data:
         raise ValueError("The image list is empty")
-    batch_size = args.batch_size
     detect(
         data=data,
         model_name=args.model,
-        batch_size=batch_size,
+        batch_size=args.batch_size,
         output_file=args.output_file,
+        options=options,
+        output_format=args.output_format,
+    )
+
+
+def resolve_detections(
+    samples: list[CachedSample],
+    model: InferenceBackend,
+    detection_cache: DetectionCache,
+) -> list[np.ndarray]:
+    """Runs the detector on the cache misses of a batch and stores their detections."""
+    # Only the cache misses hold their decoded image
+    images = [sample.image for sample in samples if sample.image is not None]
+    detected = iter(detect_people(images, model) if images else [])
+    detections = []
+    for sample in samples:
+        if sample.detections is None:
+            sample.detections = next(detected)
+            detection_cache.put(sample.key, sample.detections)
+        detections.append(sample.detections)
+    return detections
+
+
+def open_detection_cache(
+    cache_dir: str | None,
+    model: InferenceBackend | None,
+    max_megabytes: float = 1024,
+) -> DetectionCache | None:
+    if cache_dir is None or model is None:
+        return None
+    return DetectionCache(cache_dir, model.model_path, int(max_megabytes * 1e6))
+
+
+def predict_batches(
+    batches: Iterable[list[dict]],
+    model: InferenceBackend | None = None,
+    simple: bool = True,
+    decode_workers: int = 4,
+    pipeline_depth: int = 2,
+    detection_cache: DetectionCache | None = None,
+    motion: MotionScreens | None = None,
+) -> Iterator[list[dict]]:
+    """
+    Estimates the height of every batch, yielding each one as soon as it is done.
+    Decoding, inference and geometry run as pipelined stages, so while batch k
+    is in inference batch k+1 is being decoded and batch k-1 measured.
+    Args:
+        batches (Iterable[list[dict]]): Batches of samples with image path and extrinsics
+        model (InferenceBackend): Detection model, None to use the samples `gt_bbox`
+        simple (bool): Whether to use the pinhole approximation
+        decode_workers (int): Threads decoding the images of a batch
+        pipeline_depth (int): Batches allowed to wait between two stages
+        detection_cache (DetectionCache): Optional cache of the model detections
+        motion (MotionScreens): Optional screen skipping the detector on still images
+    """
+    if model is None:
+        stages = [
+            ("geometry", lambda batch: batch_detect_and_estimate(batch, simple=simple)),
+        ]
+        pipeline = Pipeline(stages, pipeline_depth)
+        yield from pipeline.run(batches)
+        tqdm.tqdm.write(pipeline.summary())
+        return
+    load = load_image if detection_cache is None else detection_cache.load
+    with ThreadPoolExecutor(max_workers=decode_workers) as pool:
+
+        def decode(batch):
+            return batch, list(pool.map(load, batch))
+
+        def infer(item):
+            batch, loaded = item
+            if detection_cache is None:
+                cameras = [sample.get("intrinsics", "") for sample in batch]
+                return batch, detect_people(loaded, model, motion, cameras)
+            return batch, resolve_detections(loaded, model, detection_cache)
+
+        def geometry(item):
+            batch, detections = item
+            return batch_detect_and_estimate(
+                batch,
+                simple=simple,
+                detections=detections,
+            )
+
+        pipeline = Pipeline(
+            [("decode", decode), ("infer", infer), ("geometry", geometry)],
+            pipeline_depth,
+        )
+        yield from pipeline.run(batches)
+    tqdm.tqdm.write(pipeline.summary())
+
+
+# State of a worker process, set once by `init_worker`
+WORKER: dict = {}
+# Keys set by `batch_detect_and_estimate`, sent back by the workers
+PREDICTION_KEYS = ("pred_height", "pred_bbox", "pred_conf")
+
+
+def init_worker(
+    model_name: str | None,
+    simple: bool,
+    options: RunOptions,
+    profile: tuple[bool, float] | None = None,
+):
+    """
+    Loads the model once per worker process (skipped for the `gt_bbox` path),
+    and enables profiling (and tracing) as in the main process, timing the
+    trace events from the main process start so both timelines line up.
+    """
+    if profile is not None:
+        trace, started = profile
+        PROFILER.enable(trace=trace, started=started)
+    UNDISTORTION_MAPS.enable(options.undistort_map_step)
+    model = None
+    if model_name is not None:
+        # Share the cores between the workers instead of oversubscribing them
+        threads = max(1, (os.cpu_count() or 1) // options.workers)
+        model = load_backend(options.backend, model_name, threads)
+    WORKER["model"] = model
+    WORKER["simple"] = simple
+    WORKER["pool"] = ThreadPoolExecutor(max_workers=options.decode_workers)
+    WORKER["detection_cache"] = open_detection_cache(
+        options.detection_cache_dir,
+        model,
+        options.detection_cache_size,
+    )
+
+
+def cache_counters(detection_cache: DetectionCache | None) -> tuple[int, int, int]:
+    if detection_cache is None:
+        return 0, 0, 0
+    return detection_cache.hits, detection_cache.misses, detection_cache.bytes_saved
+
+
+def estimate_batch_in_worker(
+    batch: list[dict],
+) -> tuple[list, tuple[int, ...], dict | None]:
+    """
+    Estimates a batch inside a worker process.
+
+    Returns:
+        The predictions of every sample, the (hits, misses, bytes saved) of the
+        detection cache and the profile of the batch, None without profiling
+    """
+    model = WORKER["model"]
+    detection_cache = WORKER["detection_cache"]
+    before = cache_counters(detection_cache)
+    if model is None:
+        batch_detect_and_estimate(batch, simple=WORKER["simple"])
+    elif detection_cache is None:
+        images = list(WORKER["pool"].map(load_image, batch))
+        batch_detect_and_estimate(batch, model, WORKER["simple"], images=images)
+    else:
+        loaded = list(WORKER["pool"].map(detection_cache.load, batch))
+        batch_detect_and_estimate(
+            batch,
+            simple=WORKER["simple"],
+            detections=resolve_detections(loaded, model, detection_cache),
+        )
+    after = cache_counters(detection_cache)
+    counters = tuple(new - old for new, old in zip(after, before))
+    predictions = [
+        {key: sample[key] for key in PREDICTION_KEYS if key in sample}
+        for sample in batch
+    ]
+    return predictions, counters, PROFILER.drain() if PROFILER.enabled else None
+
+
+def predict_batches_parallel(
+    batches: Iterable[list[dict]],
+    model_name: str | None,
+    simple: bool = True,
+    options: RunOptions | None = None,
+) -> Iterator[list[dict]]:
+    """
+    Shards the batches across `options.workers` processes, each one loading the
+    model once, and yields them back in input order.
+    Args:
+        batches (Iterable[list[dict]]): Batches of samples with image path and extrinsics
+        model_name (str): Yolo model name, None to use the samples `gt_bbox`
+        simple (bool): Whether to use the pinhole approximation
+        options (RunOptions): Execution settings
+    """
+    options = options or RunOptions()
+    hits = misses = bytes_saved = 0
+    pending: deque[tuple[list[dict], Future]] = deque()
+    with ProcessPoolExecutor(
+        max_workers=options.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(
+            model_name,
+            simple,
+            options,
+            # Tracing flag and origin of the profile, None while it is disabled
+            (PROFILER.trace, PROFILER.started) if PROFILER.enabled else None,
+        ),
+    ) as pool:
+
+        def collect() -> list[dict]:
+            nonlocal hits, misses, bytes_saved
+            batch, future = pending.popleft()
+            predictions, cache, profile = future.result()
+            batch_hits, batch_misses, batch_bytes = cache
+            if profile is not None:
+                PROFILER.merge(profile)
+            for sample, prediction in zip(batch, predictions):
+                sample.update(prediction)
+            hits, misses = hits + batch_hits, misses + batch_misses
+            bytes_saved += batch_bytes
+            return batch
+
+        for batch in batches:
+            # The batch is pickled later on, the worker gets copies still holding
+            # the decoded video frames, which are dropped here so they are
+            # neither kept until the batch returns nor serialized with it
+            future = pool.submit(
+                estimate_batch_in_worker,
+                [dict(sample) for sample in batch],
+            )
+            for sample in batch:
+                sample.pop("frame", None)
+            pending.append((batch, future))
+            # Keep every worker busy while bounding the batches in flight
+            if len(pending) >= options.pipeline_depth * options.workers:
+                yield collect()
+        while pending:
+            yield collect()
+    if model_name is not None and options.detection_cache_dir is not None:
+        tqdm.tqdm.write(detection_cache_summary(hits, misses, bytes_saved))
+
+
+def estimate_batches(
+    batches: Iterable[list[dict]],
+    model_name: str | None,
+    simple: bool = True,
+    options: RunOptions | None = None,
+) -> Iterator[list[dict]]:
+    """
+    Estimates the height of every batch in this process or across worker processes.
+    Args:
+        batches (Iterable[list[dict]]): Batches of samples with image path and extrinsics
+        model_name (str): Yolo model name, None to use the samples `gt_bbox`
+        simple (bool): Whether to use the pinhole approximation
+        options (RunOptions): Execution settings
+    """
+    options = options or RunOptions()
+    UNDISTORTION_MAPS.enable(options.undistort_map_step)
+    motion = None
+    if options.motion_screen is not None and model_name is not None:
+        if options.workers > 1 or options.detection_cache_dir is not None:
+            # Workers see interleaved batches and cached images are not decoded
+            print("The motion screen is not used with --workers or --detection-cache")
+        else:
+            motion = MotionScreens(options.motion_screen, crop=options.motion_crop)
+    if options.workers > 1:
+        yield from predict_batches_parallel(batches, model_name, simple, options)
+        return
+    model = (
+        load_backend(options.backend, model_name) if model_name is not None else None
+    )
+    detection_cache = open_detection_cache(
+        options.detection_cache_dir,
+        model,
+        options.detection_cache_size,
     )
+    yield from predict_batches(
+        batches,
+        model,
+        simple,
+        options.decode_workers,
+        options.pipeline_depth,
+        detection_cache,
+        motion,
+    )
+    print_cache_info()
+    if detection_cache is not None:
+        tqdm.tqdm.write(detection_cache.summary())
+    if motion is not None:
+        tqdm.tqdm.write(motion.summary())
+
+
+def print_cache_info():
+    for name, cache in (("Intrinsics", INTRINSICS_CACHE), ("Camera", CAMERA_CACHE)):
+        cache_info = cache.info()
+        tqdm.tqdm.write(
+            f"{name} cache: {cache_info.hits} hits, {cache_info.misses} misses, "
+            f"{cache_info.evictions} evictions",
+        )
 
 
 def detect(
@@ -233,6 +859,8 @@ def detect(
     model_name: str = "yolov8n.pt",
     batch_size: int = 32,
     simple: bool = True,
+    options: RunOptions | None = None,
+    output_format: str = "json",
 ):
     """
     Detects and estimates the height of images given extrinsics and intrinsics
@@ -241,31 +869,328 @@ def detect(
         model (str): Yolo model name
         batch_size (int): The amount of images per batch for the model
         output_file (str): The path to save the predictions
+        options (RunOptions): Execution settings (threads, pipeline, cache, workers)
+        output_format (str): json, or npz / npy columns (see `write_columns`)
     Returns:
         dict
     """
+    options = options or RunOptions()
     print(f"Preparing to process {len(data)} images")
-    if "gt_bbox" not in data[0]:
-        model = YOLO(model_name)
-    else:
-        model = None
-    image_array = np.array_split(
-        np.asarray(data),
-        max(len(data) // batch_size, 1),
+    # The predictions are set on the records in place
+    batcher = options.batcher(data, batch_size)
+    with tqdm.tqdm(total=len(data), unit="img") as progress:
+        for batch in batcher.observe(
+            estimate_batches(
+                batcher,
+                model_name if "gt_bbox" not in data[0] else None,
+                simple,
+                options,
+            ),
+        ):
+            progress.update(len(batch))
+    if options.target_batch_latency is not None:
+        tqdm.tqdm.write(batcher.summary())
+    if output_file:
+        save_predictions(data, output_file, output_format)
+    return data
+
+
+def save_predictions(
+    predictions: list[dict],
+    output_file: str,
+    output_format: str = "json",
+):
+    """Saves the predictions as a JSON list or as columns (see `write_columns`)."""
+    with timer("write"):
+        if output_format == "json":
+            with open(output_file, "w", encoding="utf-8") as file:
+                file.write(json.dumps(predictions))
+        else:
+            write_columns(output_file, predictions, output_format)
+    count_file("bytes_written", output_file)
+
+
+def detect_stream(
+    input_file: str,
+    output_file: str,
+    model_name: str = "yolov8n.pt",
+    batch_size: int = 32,
+    simple: bool = True,
+    resume: bool = True,
+    options: RunOptions | None = None,
+):
+    """
+    Streaming counterpart of `detect` for JSON Lines manifests. Records are read
+    lazily, predictions are appended to `output_file` (JSONL) as each batch
+    finishes and a checkpoint (`<output_file>.checkpoint`) is written after every
+    batch so a restarted run skips the records already done.
+    Args:
+        input_file (str): JSONL file with one image path and extrinsics per line
+        output_file (str): JSONL file where the predictions are appended
+        model_name (str): Yolo model name
+        batch_size (int): The amount of images per batch for the model
+        simple (bool): Whether to use the pinhole approximation
+        resume (bool): Whether to continue from an existing checkpoint
+        options (RunOptions): Execution settings (threads, pipeline, cache, workers)
+    """
+    checkpoint_file = f"{output_file}.checkpoint"
+    checkpoint = read_checkpoint(checkpoint_file) if resume else {}
+    done = checkpoint.get("records", 0)
+    offset = checkpoint.get("offset", 0)
+    records = iter_jsonl(input_file, skip=done)
+    first = next(records, None)
+    if first is None:
+        print(f"Nothing to process, {done} records already done")
+        return
+    print(f"Resuming after {done} records" if done else f"Processing {input_file}")
+    options = options or RunOptions()
+    batcher = options.batcher(itertools.chain([first], records), batch_size)
+    # Drop any partial write that happened after the last checkpoint
+    with open(output_file, "a+b") as file:
+        file.truncate(offset)
+    with (
+        open(output_file, "ab") as file,
+        tqdm.tqdm(initial=done, unit="img") as progress,
+    ):
+        for batch in batcher.observe(
+            estimate_batches(
+                batcher,
+                model_name if "gt_bbox" not in first else None,
+                simple,
+                options,
+            ),
+        ):
+            lines = "".join(json.dumps(sample) + "\n" for sample in batch).encode()
+            with timer("write"):
+                file.write(lines)
+                file.flush()
+                os.fsync(file.fileno())
+                done += len(batch)
+                write_checkpoint(checkpoint_file, done, file.tell())
+            count("bytes_written", len(lines))
+            progress.update(len(batch))
+    if options.target_batch_latency is not None:
+        tqdm.tqdm.write(batcher.summary())
+    print(f"Processed {done} records, predictions saved to {output_file}")
+
+
+def iter_video_samples(
+    video_path: str,
+    camera: dict,
+    rate: float | None = None,
+    decoder: str = "opencv",
+) -> Iterator[dict]:
+    """
+    Yields one sample per sampled video frame, holding the decoded `frame` together
+    with its index, timestamp and the camera parameters.
+    """
+    for index, timestamp, frame in iter_frames(video_path, rate, decoder):
+        yield {
+            "video": video_path,
+            "frame_index": index,
+            "timestamp": timestamp,
+            **camera,
+            "frame": frame,
+        }
+
+
+def detect_video(
+    video_path: str,
+    intrinsics: str,
+    extrinsics: str,
+    output_file: str | None = None,
+    model_name: str = "yolov8n.pt",
+    batch_size: int = 32,
+    rate: float | None = None,
+    simple: bool = True,
+    options: RunOptions | None = None,
+    output_format: str = "json",
+    decoder: str = "opencv",
+):
+    """
+    Estimates the height of the people of a video, decoding the frames in-process
+    and feeding them straight into the model batches (no intermediate PNG frames).
+    Args:
+        video_path (str): Path to the video file
+        intrinsics (str): Intrinsics YAML file of the camera
+        extrinsics (str): Extrinsics YAML file of the camera
+        output_file (str): The path to save the predictions (JSONL if it ends with .jsonl)
+        model_name (str): Yolo model name
+        batch_size (int): The amount of frames per batch for the model
+        rate (float): Frames per second to sample, None for every frame
+        simple (bool): Whether to use the pinhole approximation
+        options (RunOptions): Execution settings (threads, pipeline, workers)
+        output_format (str): json, or npz / npy columns, ignored for JSONL outputs
+        decoder (str): Video decoder, one of `VIDEO_DECODERS`
+    Returns:
+        list[dict]: One record per sampled frame with its index, timestamp and height
+    """
+    options = options or RunOptions()
+    if options.detection_cache_dir is not None:
+        # The detection cache is keyed by encoded image files, frames have none
+        print("The detection cache is not used with video inputs")
+        options = replace(options, detection_cache_dir=None)
+    camera = {"intrinsics": intrinsics, **load_extrinsics(extrinsics)}
+    print(
+        f"Processing {video_path}" + (f" at {rate} frames per second" if rate else ""),
+    )
+    batcher = options.batcher(
+        iter_video_samples(video_path, camera, rate, decoder),
+        batch_size,
     )
     predictions = []
-    for batch in tqdm.tqdm(image_array):
-        predictions.extend(
-            batch_detect_and_estimate(
-                data=batch.tolist(),
-                model=model,
-                simple=simple,
-            ),
+    with contextlib.ExitStack() as stack:
+        stream = None
+        if output_file and output_file.endswith(".jsonl"):
+            stream = stack.enter_context(open(output_file, "w", encoding="utf-8"))
+        progress = stack.enter_context(tqdm.tqdm(unit="frame"))
+        for batch in batcher.observe(
+            estimate_batches(batcher, model_name, simple, options),
+        ):
+            progress.update(len(batch))
+            if stream is not None:
+                with timer("write"):
+                    stream.write(
+                        "".join(json.dumps(sample) + "\n" for sample in batch),
+                    )
+            else:
+                predictions.extend(batch)
+    if options.target_batch_latency is not None:
+        tqdm.tqdm.write(batcher.summary())
+    if output_file and stream is None:
+        save_predictions(predictions, output_file, output_format)
+    elif output_file:
+        count_file("bytes_written", output_file)
+    return predictions
+
+
+def summarize_track(series: dict) -> dict:
+    """Adds the aggregate height of a track to its per-frame series."""
+    heights = np.asarray(series["pred_height"], dtype=np.float64)
+    return {
+        **series,
+        "num_frames": len(heights),
+        "median_height": float(np.median(heights)),
+        "mean_height": float(heights.mean()),
+        "std_height": float(heights.std()),
+    }
+
+
+def track_video(
+    video_path: str,
+    intrinsics: str,
+    extrinsics: str,
+    output_file: str | None = None,
+    model_name: str = "yolov8n.pt",
+    detect_every: int = 10,
+    rate: float | None = None,
+    simple: bool = True,
+    min_conf: float = 0.75,
+    options: RunOptions | None = None,
+    output_format: str = "json",
+    decoder: str = "opencv",
+):
+    """
+    Estimates the height of the people of a video running the detector only
+    every `detect_every` frames. In between, the boxes are propagated with
+    optical flow and the detector runs again as soon as a track is lost.
+    Args:
+        video_path (str): Path to the video file
+        intrinsics (str): Intrinsics YAML file of the camera
+        extrinsics (str): Extrinsics YAML file of the camera
+        output_file (str): The path to save the tracks (JSONL if it ends with .jsonl)
+        model_name (str): Yolo model name
+        detect_every (int): Frames between two detector runs
+        rate (float): Frames per second to sample, None for every frame
+        simple (bool): Whether to use the pinhole approximation
+        min_conf (float): Minimum confidence of the detections starting or updating a track
+        options (RunOptions): Execution settings (backend, undistortion maps)
+        output_format (str): Only json, the per-track series are not columnar
+        decoder (str): Video decoder, one of `VIDEO_DECODERS`
+    Returns:
+        list[dict]: One record per track with its frame indices, timestamps, boxes
+        and heights, and their aggregate height
+    """
+    if detect_every < 1:
+        raise ValueError(f"detect_every must be positive, got {detect_every}")
+    if output_format != "json":
+        raise ValueError("The tracks of --detect-every are saved as JSON or JSONL")
+    options = options or RunOptions()
+    UNDISTORTION_MAPS.enable(options.undistort_map_step)
+    camera = {"intrinsics": intrinsics, **load_extrinsics(extrinsics)}
+    params = read_camera_parameters(camera)
+    model = load_backend(options.backend, model_name)
+    tracker = MedianFlowTracker()
+    series: dict[int, dict] = {}
+    num_frames = detector_calls = 0
+    since_detection = detect_every
+    print(
+        f"Tracking {video_path}, detecting every {detect_every} frames"
+        + (f" at {rate} frames per second" if rate else ""),
+    )
+    frames = iter_frames(video_path, rate, decoder)
+    for index, timestamp, frame in tqdm.tqdm(frames):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if since_detection >= detect_every or tracker.needs_detection:
+            people = detect_people([frame], model)[0]
+            with timer("tracking"):
+                tracker.update(gray, people[people[:, 5] > min_conf, :4])
+            detector_calls += 1
+            since_detection = 0
+        else:
+            with timer("tracking"):
+                tracker.propagate(gray)
+        since_detection += 1
+        num_frames += 1
+        tracks = tracker.active
+        if not tracks:
+            continue
+        bboxes = np.array([track.box for track in tracks])
+        # Every track shares the camera of the video
+        K, R, T, C, DC = (
+            np.broadcast_to(param, (len(tracks), *param.shape)) for param in params
         )
+        with timer("geometry"):
+            heights = estimate_heights_from_bboxes(
+                bboxes,
+                K,
+                R,
+                T,
+                C,
+                DC,
+                simple=simple,
+            )
+        for track, bbox, height in zip(tracks, bboxes.tolist(), heights.tolist()):
+            track_series = series.setdefault(
+                track.track_id,
+                {
+                    "video": video_path,
+                    "track_id": track.track_id,
+                    "frame_index": [],
+                    "timestamp": [],
+                    "bbox": [],
+                    "pred_height": [],
+                },
+            )
+            track_series["frame_index"].append(index)
+            track_series["timestamp"].append(timestamp)
+            track_series["bbox"].append(bbox)
+            track_series["pred_height"].append(height)
+    tracks_summary = [summarize_track(track_series) for track_series in series.values()]
+    print(
+        f"Ran the detector on {detector_calls} of {num_frames} frames, "
+        f"{len(tracks_summary)} tracks",
+    )
     if output_file:
-        with open(output_file, "w", encoding="utf-8") as file:
-            file.write(json.dumps(data))
-    return data
+        with timer("write"), open(output_file, "w", encoding="utf-8") as file:
+            if output_file.endswith(".jsonl"):
+                file.write(
+                    "".join(json.dumps(track) + "\n" for track in tracks_summary),
+                )
+            else:
+                file.write(json.dumps(tracks_summary))
+        count_file("bytes_written", output_file)
+    return tracks_summary
 
 
 def register_subparser(
@@ -281,13 +1206,62 @@ def register_subparser(
     parser.add_argument(
         "--input-json",
         type=str,
-        help="JSON with images path for batch detection",
+        help="JSON with images path for batch detection, or a JSONL file to stream it",
+    )
+    parser.add_argument(
+        "--video",
+        type=str,
+        help="Video to decode in-process when no --input-json is given.",
+    )
+    parser.add_argument(
+        "--intrinsics",
+        type=str,
+        help="Intrinsics YAML file of the --video camera.",
+    )
+    parser.add_argument(
+        "--extrinsics",
+        type=str,
+        help="Extrinsics YAML file of the --video camera.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Frames per second sampled from --video (default: every frame).",
+    )
+    parser.add_argument(
+        "--video-decoder",
+        type=str,
+        choices=VIDEO_DECODERS,
+        default="opencv",
+        help="Decoder of --video: OpenCV in-process, or raw frames piped by an ffmpeg process.",
+    )
+    parser.add_argument(
+        "--detect-every",
+        type=int,
+        default=1,
+        help="Run the detector every N frames of --video and track the people in between, "
+        "saving one height series per track.",
     )
     parser.add_argument(
         "--batch-size",
         type=int,
         default=32,
-        help="Extrinsics config YAML file.",
+        help="Number of images per model batch, the initial one with --dynamic-batch.",
+    )
+    parser.add_argument(
+        "--dynamic-batch",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Adapt the batch size so that a batch takes about SECONDS, "
+        "doubling it while batches are faster and halving it when slower.",
+    )
+    parser.add_argument(
+        "--max-rss",
+        type=float,
+        default=None,
+        help="Resident memory in MB above which --dynamic-batch shrinks the batches.",
     )
     parser.add_argument(
         "--output-file",
@@ -295,11 +1269,82 @@ def register_subparser(
         default="data/mydataset-estimation.json",
         help="Extrinsics config YAML file.",
     )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        choices=OUTPUT_FORMATS,
+        default="json",
+        help="Format of --output-file: json, a npz archive of typed columns, "
+        "or npy for a directory with one memory-mappable file per column "
+        "(json only for JSONL inputs and --detect-every tracks).",
+    )
     parser.add_argument(
         "--model",
         type=str,
         default="yolov8n.pt",
-        help="YOLO model path.",
+        help="YOLO model path, an exported .onnx model for the onnxruntime and opencv backends.",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=list(BACKENDS),
+        default="ultralytics",
+        help="Inference backend running the model.",
+    )
+    parser.add_argument(
+        "--decode-workers",
+        type=int,
+        default=4,
+        help="Number of threads decoding the images of a batch.",
+    )
+    parser.add_argument(
+        "--pipeline-depth",
+        type=int,
+        default=2,
+        help="Number of batches allowed to wait between the decode, inference and geometry stages.",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Ignore the checkpoint of a previous JSONL run and start over.",
+    )
+    parser.add_argument(
+        "--detection-cache",
+        type=str,
+        default=None,
+        help="Directory caching the person detections by image and model weights hash.",
+    )
+    parser.add_argument(
+        "--detection-cache-size",
+        type=float,
+        default=1024,
+        help="Maximum size of the detection cache in MB.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes sharing the batches, each one loading the model once.",
+    )
+    parser.add_argument(
+        "--motion-screen",
+        type=str,
+        choices=MOTION_METHODS,
+        default=None,
+        help="Skip the detector on the images where nothing moved since the previous image "
+        "of the camera, with a MOG2 background model or frame differencing.",
+    )
+    parser.add_argument(
+        "--motion-crop",
+        action="store_true",
+        help="With --motion-screen, run the detector on the moving region of the images only.",
+    )
+    parser.add_argument(
+        "--undistort-map-step",
+        type=float,
+        default=None,
+        help="Undistort bbox endpoints with per-camera lookup tables sampled every N pixels "
+        "(below 1 for sub-pixel), persisted next to the intrinsics.",
     )
 
     parser.set_defaults(func=main)
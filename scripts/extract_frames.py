@@ -1,33 +1,279 @@
 from __future__ import annotations
 
 import argparse
+import bisect
 import glob
+import math
 import os
+import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
+import cv2
+
+from scripts.lib.frame_store import encode_params
+from scripts.lib.frame_store import FRAME_CODECS
+from scripts.lib.frame_store import FrameStoreWriter
+from scripts.lib.frame_store import is_frame_store
+from scripts.lib.profiling import count
+from scripts.lib.profiling import count_file
+from scripts.lib.profiling import timer
 from scripts.lib.utils import get_config_parser
 from scripts.lib.utils import load_yaml_defaults
+from scripts.lib.video import iter_ffmpeg_frames
+from scripts.lib.video import probe_keyframes
 
 COMMAND_NAME = "extract-frames"
+# Formats of a directory of frames, a frame store also takes the FRAME_CODECS
+IMAGE_FORMATS = ("png", "jpg")
+
+
+def write_piped_frames(
+    input_path: str,
+    output_dir: str,
+    rate: float,
+    image_format: str = "png",
+    quality: int = 95,
+    png_compression: int = 1,
+) -> int:
+    """
+    Writes the frames decoded by `iter_ffmpeg_frames` with OpenCV, named like
+    the frames written by ffmpeg. Returns the number of frames written.
+    """
+    params = encode_params(image_format, quality, png_compression)
+    written = 0
+    for index, _, frame in iter_ffmpeg_frames(input_path, rate):
+        path = os.path.join(output_dir, f"frame_{index + 1:05d}.{image_format}")
+        with timer("encode"):
+            cv2.imwrite(path, frame, params)
+        count_file("bytes_written", path)
+        count("frames_written")
+        written += 1
+    return written
+
+
+def write_frame_store(
+    input_path: str,
+    store_path: str,
+    rate: float,
+    codec: str = "png",
+    quality: int = 95,
+    png_compression: int = 1,
+) -> int:
+    """
+    Writes the frames decoded by `iter_ffmpeg_frames` in a frame store, with
+    their timestamp and the video name as camera. Returns the number of frames written.
+    """
+    camera = os.path.splitext(os.path.basename(input_path))[0]
+    with FrameStoreWriter(store_path, codec, quality, png_compression) as writer:
+        for _, timestamp, frame in iter_ffmpeg_frames(input_path, rate):
+            writer.append(frame, timestamp, camera)
+    return len(writer)
+
+
+def frame_tick(timestamp: float, rate: float) -> int:
+    """Output frame of the ffmpeg fps filter a timestamp is rounded to (half away from zero)."""
+    return math.floor(timestamp * rate + 0.5)
+
 
+def plan_segments(
+    keyframes: list[float],
+    duration: float,
+    segments: int,
+) -> list[tuple[float, float | None]]:
+    """
+    Splits a video in about `segments` parts of equal duration, cut on the first
+    keyframe after each split point, so a worker can seek exactly to its start.
+
+    Returns:
+        list of (start, end) seconds, end is None for the last segment.
+    """
+    starts = [0.0]
+    for i in range(1, segments):
+        position = bisect.bisect_left(keyframes, duration * i / segments)
+        if position < len(keyframes) and keyframes[position] > starts[-1]:
+            starts.append(keyframes[position])
+    ends: list[float | None] = [*starts[1:], None]
+    return list(zip(starts, ends))
 
-def extract_frames(input_path: str, output_dir: str, rate: float) -> None:
+
+def extract_segment(
+    input_path: str,
+    segment_dir: str,
+    start: float,
+    end: float | None,
+    rate: float,
+    image_format: str,
+) -> None:
+    """
+    Extracts the frames of a segment, named after their output frame in the
+    whole video: timestamps are kept (-copyts), so the fps filter rounds them on
+    the same grid as a single ffmpeg run, and the muxer names the frames with it.
     """
-    Extracts frames from a video file using ffmpeg at a specified frame rate.
+    os.makedirs(segment_dir, exist_ok=True)
+    command = ["ffmpeg", "-nostdin", "-v", "error"]
+    if start > 0:
+        # Seeking just before the keyframe, which is decoded as the first frame
+        command += ["-ss", f"{max(start - 1e-3, 0.0):.6f}"]
+    if end is not None:
+        # A frame of slack, the frames past the segment are dropped when stitching
+        command += ["-t", f"{end - max(start - 1e-3, 0.0) + 1 / rate:.6f}"]
+    command += [
+        "-copyts",
+        "-start_at_zero",
+        "-i",
+        input_path,
+        "-vf",
+        f"fps={rate}",
+        "-frame_pts",
+        "1",
+        os.path.join(segment_dir, f"%d.{image_format}"),
+    ]
+    subprocess.run(command, check=True)
+
+
+def extract_frames_parallel(
+    input_path: str,
+    output_dir: str,
+    rate: float,
+    jobs: int,
+    image_format: str = "png",
+) -> int:
+    """
+    Extracts the frames of a long video with `jobs` ffmpeg processes, each one
+    decoding its own keyframe-aligned segments. A segment keeps the output
+    frames from the one of its first keyframe up to the first one of the next
+    segment, which are renamed `frame_%05d` as a single ffmpeg run names them.
+
+    Returns:
+        int: Number of frames extracted.
+    """
+    with timer("probe"):
+        keyframes, duration = probe_keyframes(input_path)
+    # More segments than workers to balance segments of unequal length
+    segments = plan_segments(keyframes, duration, jobs * 2)
+    segment_dirs = [
+        os.path.join(output_dir, f".segment_{i:03d}") for i in range(len(segments))
+    ]
+    with timer("ffmpeg"), ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            pool.submit(
+                extract_segment,
+                input_path,
+                segment_dir,
+                start,
+                end,
+                rate,
+                image_format,
+            )
+            for (start, end), segment_dir in zip(segments, segment_dirs)
+        ]
+        for future in futures:
+            future.result()
+    ticks = []
+    with timer("stitch"):
+        for (start, end), segment_dir in zip(segments, segment_dirs):
+            first = frame_tick(start, rate)
+            last = frame_tick(end, rate) if end is not None else math.inf
+            for name in os.listdir(segment_dir):
+                tick = int(os.path.splitext(name)[0])
+                if first <= tick < last:
+                    os.replace(
+                        os.path.join(segment_dir, name),
+                        os.path.join(
+                            output_dir,
+                            f"frame_{tick + 1:05d}.{image_format}",
+                        ),
+                    )
+                    ticks.append(tick)
+            shutil.rmtree(segment_dir)
+    missing = len(ticks) and max(ticks) + 1 - len(ticks)
+    if missing:
+        print(f"Warning: {missing} frames missing between the segments")
+    return len(ticks)
+
+
+def extract_frames(
+    input_path: str,
+    output_dir: str,
+    rate: float,
+    pipe: bool = False,
+    image_format: str = "png",
+    quality: int = 95,
+    png_compression: int = 1,
+    jobs: int = 1,
+) -> None:
+    """
+    Extracts frames from a video file using ffmpeg at a specified frame rate,
+    in a directory or, if `output_dir` ends with `.frames`, in a frame store.
 
     Args:
         input_path (str): Path to the input video file.
+        output_dir (str): Directory of the frames, or frame store.
         rate (float): Frame extraction rate (frames per second).
+        pipe (bool): Whether ffmpeg pipes raw frames that are encoded here, with
+            the chosen format and quality, instead of writing the images itself.
+        image_format (str): png or jpg, also raw or webp in a frame store.
+        quality (int): JPEG quality, with `pipe`.
+        png_compression (int): PNG compression level from 0 (fastest) to 9, with `pipe`.
+        jobs (int): Number of ffmpeg processes extracting segments of the video.
     """
     if not os.path.isfile(input_path):
         raise FileNotFoundError(f"Input file not found: {input_path}")
+    store = is_frame_store(output_dir)
+    if image_format not in (FRAME_CODECS if store else IMAGE_FORMATS):
+        raise ValueError(f"Unknown image format: {image_format}")
+    if (pipe or store) and jobs > 1:
+        raise ValueError(
+            "--pipe and frame stores extract with a single ffmpeg process, without --jobs",
+        )
+
+    if store:
+        written = write_frame_store(
+            input_path,
+            output_dir,
+            rate,
+            image_format,
+            quality,
+            png_compression,
+        )
+        count_file("bytes_read", input_path)
+        print(f"{written} frames extracted to: {output_dir}")
+        return
 
     os.makedirs(output_dir, exist_ok=True)
-    files = glob.glob(os.path.join(output_dir, "frame_*.png"))
+    files = glob.glob(os.path.join(output_dir, f"frame_*.{image_format}"))
     for file in files:
         os.remove(file)
 
-    output_pattern = os.path.join(output_dir, "frame_%05d.png")
+    if pipe:
+        written = write_piped_frames(
+            input_path,
+            output_dir,
+            rate,
+            image_format,
+            quality,
+            png_compression,
+        )
+        count_file("bytes_read", input_path)
+        print(f"{written} frames extracted to: {output_dir}")
+        return
+    if jobs > 1:
+        written = extract_frames_parallel(
+            input_path,
+            output_dir,
+            rate,
+            jobs,
+            image_format,
+        )
+        count_file("bytes_read", input_path)
+        for file in glob.glob(os.path.join(output_dir, f"frame_*.{image_format}")):
+            count_file("bytes_written", file)
+        count("frames_written", written)
+        print(f"{written} frames extracted to: {output_dir}")
+        return
+
+    output_pattern = os.path.join(output_dir, f"frame_%05d.{image_format}")
     command = [
         "ffmpeg",
         "-i",
@@ -38,8 +284,13 @@ def extract_frames(input_path: str, output_dir: str, rate: float) -> None:
     ]
 
     try:
-        subprocess.run(command, check=True)
+        with timer("ffmpeg"):
+            subprocess.run(command, check=True)
         print(f"Frames extracted to: {output_dir}")
+        count_file("bytes_read", input_path)
+        for file in glob.glob(os.path.join(output_dir, f"frame_*.{image_format}")):
+            count_file("bytes_written", file)
+            count("frames_written")
     except subprocess.CalledProcessError as e:
         print(f"Error during ffmpeg execution: {e}")
         raise
@@ -70,7 +321,7 @@ def register_subparser(
         "--frames-dir",
         type=str,
         default=os.path.join("data", "cam1-cut-frames"),
-        help="Path to the input video file.",
+        help="Directory of the extracted frames, or frame store if it ends with .frames.",
     )
     parser.add_argument(
         "--rate",
@@ -78,8 +329,48 @@ def register_subparser(
         default=1,
         help="Frame extraction rate (frames per second).",
     )
+    parser.add_argument(
+        "--pipe",
+        action="store_true",
+        help="Read raw frames from ffmpeg and encode them here with --image-format and --quality.",
+    )
+    parser.add_argument(
+        "--image-format",
+        type=str,
+        choices=FRAME_CODECS,
+        default="png",
+        help="Format of the extracted frames, raw and webp only in a frame store.",
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=95,
+        help="JPEG or WebP quality of the frames written with --pipe or in a frame store.",
+    )
+    parser.add_argument(
+        "--png-compression",
+        type=int,
+        default=1,
+        help="PNG compression level of the frames written with --pipe or in a frame store, "
+        "from 0 (fastest) to 9.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of ffmpeg processes, each one extracting keyframe-aligned segments of the video.",
+    )
     parser.set_defaults(
-        func=lambda args: extract_frames(args.frames, args.frames_dir, args.rate),
+        func=lambda args: extract_frames(
+            args.frames,
+            args.frames_dir,
+            args.rate,
+            args.pipe,
+            args.image_format,
+            args.quality,
+            args.png_compression,
+            args.jobs,
+        ),
     )
     return parser
 
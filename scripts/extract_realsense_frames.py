@@ -1,13 +1,15 @@
 from __future__ import annotations
 
 import argparse
-import glob
 import os
+import time
 
-import cv2
 import numpy as np
 import pyrealsense2 as rs
 
+from scripts.lib.frame_store import FRAME_CODECS
+from scripts.lib.frame_writer import FrameWriterPool
+from scripts.lib.profiling import timer
 from scripts.lib.utils import get_config_parser
 from scripts.lib.utils import load_yaml_defaults
 
@@ -42,34 +44,57 @@ def extract_realsense_frames(
     rate: float = 1.0,
     start_time: float = 0.0,
     end_time: float | None = None,
+    image_format: str = "png",
+    quality: int = 95,
+    png_compression: int = 1,
+    write_workers: int = 4,
 ) -> None:
     """
     Extracts color frames from a RealSense .bag file at a given frame rate and within a time interval.
+    Frames are encoded and written by a pool of threads while playback goes on,
+    so a non real-time playback runs at decoding speed.
 
     Args:
         bag_path (str): Path to the RealSense .bag file.
-        output_dir (str, optional): Output directory for extracted frames.
+        output_dir (str, optional): Output directory for extracted frames, or frame
+            store if it ends with `.frames`.
         rate (float): Frame sampling interval in seconds (e.g., 1 = every second).
         start_time (float): Starting timestamp in seconds.
         end_time (float): Ending timestamp in seconds. If None, reads until the end.
+        image_format (str): png, jpg or webp, also raw in a frame store.
+        quality (int): JPEG or WebP quality.
+        png_compression (int): PNG compression level from 0 (fastest) to 9.
+        write_workers (int): Number of threads encoding and writing the frames.
     """
     if not os.path.isfile(bag_path):
         raise FileNotFoundError(f"File not found: {bag_path}")
 
-    os.makedirs(output_dir, exist_ok=True)
-    files = glob.glob(os.path.join(output_dir, "frame_*.png"))
-    for file in files:
-        os.remove(file)
+    # Validates the output settings before the playback is started
+    writer = FrameWriterPool(
+        output_dir,
+        image_format,
+        quality,
+        png_compression,
+        workers=write_workers,
+        camera=os.path.splitext(os.path.basename(bag_path))[0],
+    )
 
     pipeline = rs.pipeline()
     config = rs.config()
     config.enable_device_from_file(bag_path, repeat_playback=False)
     config.enable_stream(rs.stream.color)
 
-    profile = pipeline.start(config)
-    device = profile.get_device()
-    playback = device.as_playback()
-    playback.set_real_time(False)
+    profile = None
+    try:
+        profile = pipeline.start(config)
+        device = profile.get_device()
+        playback = device.as_playback()
+        playback.set_real_time(False)
+    except Exception:
+        if profile is not None:
+            pipeline.stop()
+        writer.close()
+        raise
 
     print(f"Processing: {bag_path}")
     print(
@@ -83,9 +108,11 @@ def extract_realsense_frames(
 
     first_timestamp = None
 
+    started = time.perf_counter()
     try:
         while True:
-            frames = pipeline.wait_for_frames()
+            with timer("bag_decode"):
+                frames = pipeline.wait_for_frames()
             color_frame = frames.get_color_frame()
             if not color_frame:
                 continue
@@ -103,9 +130,10 @@ def extract_realsense_frames(
             if end_time is not None and relative_time > end_time:
                 break
             if relative_time >= next_capture_time:
-                color_image = np.asanyarray(color_frame.get_data())
-                filename = os.path.join(output_dir, f"frame_{saved_count+1:05d}.png")
-                cv2.imwrite(filename, color_image)
+                # The only copy out of the librealsense buffer, which is
+                # recycled once the frame is released
+                color_image = np.array(color_frame.get_data(), copy=True)
+                writer.submit(color_image, relative_time)
                 saved_count += 1
                 next_capture_time += rate
 
@@ -116,7 +144,14 @@ def extract_realsense_frames(
 
     finally:
         pipeline.stop()
+        with timer("write_drain"):
+            writer.close()
+        elapsed = max(time.perf_counter() - started, 1e-9)
         print(f"Saved {saved_count} frames from {frame_count} processed.")
+        print(
+            f"{elapsed:.1f}s: {frame_count / elapsed:.1f} frames/s read, "
+            f"{saved_count / elapsed:.1f} frames/s saved",
+        )
 
 
 def register_subparser(
@@ -142,7 +177,7 @@ def register_subparser(
     parser.add_argument(
         "--frames-dir",
         default=os.path.join("data", "cam4-cut-frames"),
-        help="Directory to output the extracted frames",
+        help="Directory to output the extracted frames, or frame store if it ends with .frames",
     )
     parser.add_argument(
         "--rate",
@@ -162,6 +197,31 @@ def register_subparser(
         default="00:00:27",
         help="End time in HH:MM:SS format (default: end of file)",
     )
+    parser.add_argument(
+        "--image-format",
+        type=str,
+        choices=FRAME_CODECS,
+        default="png",
+        help="Format of the extracted frames, raw only in a frame store",
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=95,
+        help="JPEG or WebP quality of the frames",
+    )
+    parser.add_argument(
+        "--png-compression",
+        type=int,
+        default=1,
+        help="PNG compression level of the frames, from 0 (fastest) to 9",
+    )
+    parser.add_argument(
+        "--write-workers",
+        type=int,
+        default=4,
+        help="Number of threads encoding and writing the frames while the bag is read",
+    )
 
     def wrapped(args):
         start_seconds = parse_timestamp(args.start)
@@ -172,6 +232,10 @@ def register_subparser(
             rate=args.rate,
             start_time=start_seconds,
             end_time=end_seconds,
+            image_format=args.image_format,
+            quality=args.quality,
+            png_compression=args.png_compression,
+            write_workers=args.write_workers,
         )
 
     parser.set_defaults(func=wrapped)
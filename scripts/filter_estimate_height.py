@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+
+import numpy as np
+import tqdm
+
+from scripts.estimate_height import batch_detect_and_estimate
+from scripts.estimate_height import save_predictions
+from scripts.estimate_height import select_person_index
+from scripts.filter_frames import PersonGate
+from scripts.lib.backends import BACKENDS
+from scripts.lib.backends import InferenceBackend
+from scripts.lib.backends import load_backend
+from scripts.lib.backends import Prediction
+from scripts.lib.columnar import OUTPUT_FORMATS
+from scripts.lib.frame_store import list_frames as list_frame_paths
+from scripts.lib.motion import MOTION_METHODS
+from scripts.lib.motion import MotionScreens
+from scripts.lib.motion import predict
+from scripts.lib.prefetch import prefetch_batches
+from scripts.lib.prefetch import read_image
+from scripts.lib.stream import batched
+from scripts.lib.utils import get_config_parser
+from scripts.lib.utils import load_extrinsics
+from scripts.lib.utils import load_yaml_defaults
+
+COMMAND_NAME = "filter-estimate-height"
+
+
+def gate_person(
+    prediction: Prediction,
+    whole: np.ndarray,
+    min_conf: float = 0.75,
+) -> np.ndarray:
+    """
+    Keeps the person the height is measured on only if the whole person is in
+    the frame.
+
+    Args:
+        prediction (Prediction): Pose model output for the frame.
+        whole (np.ndarray): (M,) mask of the detections passing the `PersonGate`.
+        min_conf (float): Minimum confidence of the measured person.
+
+    Returns:
+        np.ndarray: (1, 6) detection of the tallest confident person, or an
+        empty (0, 6) array if there is none or it is cropped.
+    """
+    people = prediction.boxes[:, 4].astype(int) == 0
+    detections = prediction.boxes[people]
+    index = select_person_index(detections, min_conf)
+    if index is None or not whole[people][index]:
+        return detections[:0]
+    return detections[index : index + 1]
+
+
+def filter_and_estimate(
+    records: list[dict],
+    pose_model: InferenceBackend,
+    gate: PersonGate | None = None,
+    batch_size: int = 16,
+    decode_workers: int = 4,
+    simple: bool = True,
+    motion: MotionScreens | None = None,
+) -> list[dict]:
+    """
+    Checks that a whole person is in every frame and estimates its height, in
+    a single pass: each frame is decoded once and goes through the pose model
+    once, whose boxes are the ones measured.
+
+    Args:
+        records (list[dict]): Samples with image path, intrinsics and extrinsics.
+        pose_model (InferenceBackend): Pose model.
+        gate (PersonGate): Criteria of a whole person, its defaults if None.
+        batch_size (int): Number of frames per pose model call.
+        decode_workers (int): Number of threads decoding the upcoming batches.
+        simple (bool): Whether to use the pinhole approximation.
+        motion (MotionScreens): Optional screen skipping the frames where nothing moved.
+
+    Returns:
+        list[dict]: One record per frame with `decoded`, `whole_person`,
+        `pred_height`, `pred_bbox` and `pred_conf`, the predictions are None for
+        frames without a whole person or that could not be decoded.
+    """
+    gate = gate or PersonGate()
+    results = []
+    with tqdm.tqdm(total=len(records), unit="img") as progress:
+        for batch, frames in prefetch_batches(
+            batched(records, batch_size),
+            read_image,
+            workers=decode_workers,
+        ):
+            decoded = []
+            for sample, frame in zip(batch, frames):
+                sample["decoded"] = frame is not None
+                if frame is not None:
+                    decoded.append((sample, frame))
+                else:
+                    sample.update(
+                        whole_person=False,
+                        pred_height=None,
+                        pred_bbox=None,
+                        pred_conf=None,
+                    )
+            progress.update(len(batch))
+            results.extend(batch)
+            if not decoded:
+                continue
+            predictions = predict(
+                pose_model,
+                [frame for _, frame in decoded],
+                motion,
+                [sample.get("intrinsics", "") for sample, _ in decoded],
+            )
+            masks = gate.masks(
+                [prediction.keypoints for prediction in predictions],
+                [frame.shape[0] for _, frame in decoded],
+            )
+            detections = [
+                gate_person(prediction, mask)
+                for prediction, mask in zip(predictions, masks)
+            ]
+            samples = [sample for sample, _ in decoded]
+            batch_detect_and_estimate(samples, simple=simple, detections=detections)
+            for sample, detected in zip(samples, detections):
+                sample["whole_person"] = len(detected) > 0
+    return results
+
+
+def list_frames(input_dir: str, intrinsics: str, extrinsics: str) -> list[dict]:
+    """Builds the samples of a directory of frames or frame store of a single camera."""
+    camera = {"intrinsics": intrinsics, **load_extrinsics(extrinsics)}
+    return [
+        {"image_path": image_path, **camera}
+        for image_path in list_frame_paths(input_dir)
+    ]
+
+
+def main(args: argparse.Namespace) -> None:
+    if args.input_json:
+        with open(args.input_json, encoding="utf-8") as file:
+            records = json.load(file)
+    else:
+        records = list_frames(args.input_dir, args.intrinsics, args.extrinsics)
+    if not records:
+        raise ValueError("The image list is empty")
+    pose_model = load_backend(args.backend, args.model)
+    motion = None
+    if args.motion_screen is not None:
+        motion = MotionScreens(args.motion_screen, crop=args.motion_crop)
+    results = filter_and_estimate(
+        records,
+        pose_model,
+        PersonGate(args.margin, require_head=args.require_head, upright=args.upright),
+        args.batch_size,
+        args.decode_workers,
+        motion=motion,
+    )
+    if motion is not None:
+        print(motion.summary())
+    save_predictions(results, args.output_file, args.output_format)
+    whole = sum(result["whole_person"] for result in results)
+    failed = sum(not result["decoded"] for result in results)
+    print(
+        f"Saved {len(results)} records to {args.output_file}: {whole} frames with "
+        f"a whole person, {failed} frames that could not be decoded",
+    )
+
+
+def register_subparser(
+    subparsers: argparse._SubParsersAction,
+) -> argparse.ArgumentParser:
+    """
+    Registers the 'filter-estimate-height' subparser for CLI.
+
+    Args:
+        subparsers (argparse._SubParsersAction): The subparsers object from the main parser.
+    """
+    parser = subparsers.add_parser(
+        COMMAND_NAME,
+        help="Filter the frames with a whole person and estimate their height in one pass.",
+        parents=[get_config_parser()],
+        conflict_handler="resolve",
+    )
+    parser.add_argument(
+        "--input-json",
+        type=str,
+        help="JSON with the images path, intrinsics and extrinsics, as for estimate-height.",
+    )
+    parser.add_argument(
+        "--input-dir",
+        type=str,
+        default=os.path.join("data", "original", "images"),
+        help="Directory of frames or .frames store of a single camera, when no --input-json is given.",
+    )
+    parser.add_argument(
+        "--intrinsics",
+        type=str,
+        help="Intrinsics YAML file of the --input-dir camera.",
+    )
+    parser.add_argument(
+        "--extrinsics",
+        type=str,
+        help="Extrinsics YAML file of the --input-dir camera.",
+    )
+    parser.add_argument(
+        "--output-file",
+        type=str,
+        default="data/mydataset-estimation.json",
+        help="File saving one record per frame.",
+    )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        choices=OUTPUT_FORMATS,
+        default="json",
+        help="Format of --output-file, see estimate-height.",
+    )
+    parser.add_argument(
+        "--margin",
+        type=int,
+        default=10,
+        help="Margin to tolerate against the image bottom edge.",
+    )
+    parser.add_argument(
+        "--require-head",
+        action="store_true",
+        help="Also require the head of the person to be visible, see filter-frames.",
+    )
+    parser.add_argument(
+        "--upright",
+        action="store_true",
+        help="Also require the torso of the person to be upright, see filter-frames.",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default="yolov8n-pose.pt",
+        help="YOLO pose model path, an exported .onnx model for the onnxruntime and opencv backends.",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=list(BACKENDS),
+        default="ultralytics",
+        help="Inference backend running the pose model.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=16,
+        help="Number of frames per pose model call.",
+    )
+    parser.add_argument(
+        "--decode-workers",
+        type=int,
+        default=4,
+        help="Number of threads decoding the upcoming frames.",
+    )
+    parser.add_argument(
+        "--motion-screen",
+        type=str,
+        choices=MOTION_METHODS,
+        default=None,
+        help="Skip the pose model on the frames where nothing moved, see estimate-height.",
+    )
+    parser.add_argument(
+        "--motion-crop",
+        action="store_true",
+        help="With --motion-screen, run the pose model on the moving region of the frames only.",
+    )
+    parser.set_defaults(func=main)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Filter frames and estimate person height in a single pass.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparser = register_subparser(subparsers)
+    args, _ = parser.parse_known_args()
+    if args.config and args.command:
+        load_yaml_defaults(subparser, args.config)
+    args = parser.parse_args()
+    args.func(args)
@@ -3,18 +3,141 @@ from __future__ import annotations
 import argparse
 import json
 import os
-from typing import Any
+from dataclasses import asdict
+from dataclasses import dataclass
 
-import cv2
-from ultralytics import YOLO
+import numpy as np
 
+from scripts.lib.backends import BACKENDS
+from scripts.lib.backends import InferenceBackend
+from scripts.lib.backends import load_backend
+from scripts.lib.backends import NUM_KEYPOINTS
+from scripts.lib.frame_manifest import FrameManifest
+from scripts.lib.frame_manifest import model_key
+from scripts.lib.frame_store import frame_signature
+from scripts.lib.frame_store import list_frames
+from scripts.lib.frame_store import read_frame
+from scripts.lib.motion import MOTION_METHODS
+from scripts.lib.motion import MotionScreens
+from scripts.lib.motion import predict
+from scripts.lib.prefetch import prefetch_batches
+from scripts.lib.profiling import count
+from scripts.lib.profiling import count_file
+from scripts.lib.profiling import timer
+from scripts.lib.stream import batched
 from scripts.lib.utils import get_config_parser
 
 COMMAND_NAME = "filter-frames"
+# Classification of the frames kept in the output directory between runs
+MANIFEST_NAME = "filter_manifest.json"
+
+
+# COCO keypoints checked by `PersonGate`: nose, eyes and ears
+HEAD_KEYPOINTS = [0, 1, 2, 3, 4]
+SHOULDER_KEYPOINTS = [5, 6]
+HIP_KEYPOINTS = [11, 12]
+ANKLE_KEYPOINTS = [15, 16]
+
+
+@dataclass(frozen=True)
+class PersonGate:
+    """
+    Criteria a detected person must meet for the frame to be kept. Both ankles
+    must be visible and not cropped at the bottom edge, and optionally the
+    head must be visible and the torso upright.
+
+    Attributes:
+        margin: Margin from the bottom to consider foot uncropped.
+        min_conf: Minimum confidence of a visible keypoint.
+        require_head: Whether the nose, an eye or an ear must be visible.
+        upright: Whether the torso must be upright.
+        max_tilt: Maximum angle in degrees between the vertical and the torso,
+            from the middle of the hips to the middle of the shoulders.
+    """
+
+    margin: int = 10
+    min_conf: float = 0.5
+    require_head: bool = False
+    upright: bool = False
+    max_tilt: float = 30.0
+
+    def evaluate(self, keypoints: np.ndarray, image_heights: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            keypoints: (N, 17, 3) COCO keypoints [x, y, conf] of N people.
+            image_heights: (N,) height of the image of every person.
+
+        Returns:
+            (N,) boolean mask of the people meeting the criteria.
+        """
+        visible = keypoints[..., 2] > self.min_conf
+        bottom = np.asarray(image_heights, dtype=np.float32)[..., np.newaxis]
+        ankles_inside = keypoints[..., ANKLE_KEYPOINTS, 1] < bottom - self.margin
+        mask = (visible[..., ANKLE_KEYPOINTS] & ankles_inside).all(axis=-1)
+        if self.require_head:
+            mask &= visible[..., HEAD_KEYPOINTS].any(axis=-1)
+        if self.upright:
+            shoulders = keypoints[..., SHOULDER_KEYPOINTS, :2].mean(axis=-2)
+            hips = keypoints[..., HIP_KEYPOINTS, :2].mean(axis=-2)
+            torso = shoulders - hips
+            # Image y grows downwards, an upright torso points to negative y
+            tilt = np.degrees(np.arctan2(np.abs(torso[..., 0]), -torso[..., 1]))
+            mask &= visible[..., SHOULDER_KEYPOINTS + HIP_KEYPOINTS].all(axis=-1)
+            mask &= tilt <= self.max_tilt
+        return np.asarray(mask)
+
+    def _evaluate_batch(
+        self,
+        keypoints: list[np.ndarray | None],
+        image_heights: list[int],
+    ) -> tuple[np.ndarray, list[int]]:
+        people = [
+            (
+                np.empty((0, NUM_KEYPOINTS, 3), dtype=np.float32)
+                if image_keypoints is None
+                else image_keypoints
+            )
+            for image_keypoints in keypoints
+        ]
+        counts = [len(image_people) for image_people in people]
+        mask = self.evaluate(
+            np.concatenate(people).reshape(-1, NUM_KEYPOINTS, 3),
+            np.repeat(image_heights, counts),
+        )
+        return mask, counts
+
+    def masks(
+        self,
+        keypoints: list[np.ndarray | None],
+        image_heights: list[int],
+    ) -> list[np.ndarray]:
+        """
+        Evaluates the people of a batch of images in a single array expression.
+
+        Args:
+            keypoints: (M, 17, 3) keypoints of the people of every image, None without pose.
+            image_heights: Height of every image.
+
+        Returns:
+            One (M,) boolean mask per image.
+        """
+        mask, counts = self._evaluate_batch(keypoints, image_heights)
+        ends = np.cumsum(counts).tolist()
+        return [mask[end - size : end] for end, size in zip(ends, counts)]
+
+    def any_person(
+        self,
+        keypoints: list[np.ndarray | None],
+        image_heights: list[int],
+    ) -> np.ndarray:
+        """Like `masks`, but returns whether each image holds a person meeting the criteria."""
+        mask, counts = self._evaluate_batch(keypoints, image_heights)
+        image_index = np.repeat(np.arange(len(counts)), counts)
+        return np.bincount(image_index, weights=mask, minlength=len(counts)) > 0
 
 
 def is_whole_person_in_frame(
-    yolo_result: Any,
+    keypoints: np.ndarray | None,
     image_height: int,
     margin: int = 10,
 ) -> bool:
@@ -22,80 +145,165 @@ def is_whole_person_in_frame(
     Check if both ankles are visible and not cropped at the bottom edge.
 
     Args:
-        yolo_result: YOLO result object containing keypoints.
+        keypoints: (M, 17, 3) COCO keypoints [x, y, conf] of the detected people.
         image_height: Height of the image.
         margin: Margin from the bottom to consider foot uncropped.
 
     Returns:
         True if both ankles are detected and well inside the image.
     """
-    if not yolo_result.keypoints or len(yolo_result.keypoints.data) == 0:
-        return False
+    return bool(PersonGate(margin).any_person([keypoints], [image_height])[0])
 
-    for kp in yolo_result.keypoints.data:
-        left_ankle = kp[15]  # [x, y, conf]
-        right_ankle = kp[16]
 
-        if (
-            left_ankle[2] > 0.5
-            and right_ankle[2] > 0.5
-            and left_ankle[1] < image_height - margin
-            and right_ankle[1] < image_height - margin
-        ):
-            return True
-    return False
+def classify_frames(
+    img_paths: list[str],
+    signatures: dict[str, list[int]],
+    manifest: FrameManifest,
+    gate: PersonGate,
+    pose_model: InferenceBackend,
+    batch_size: int = 16,
+    decode_workers: int = 4,
+    motion: MotionScreens | None = None,
+) -> None:
+    """
+    Runs the pose model over the frames, recording whether each one is valid in
+    the manifest. Frames the motion screen finds still are recorded as invalid,
+    so the motion settings must be part of the manifest criteria.
+    """
+    # Frames of the next batches are decoded while the current one is inferred
+    for batch, frames in prefetch_batches(
+        batched(img_paths, batch_size),
+        read_frame,
+        workers=decode_workers,
+    ):
+        decoded = []
+        for img_path, frame in zip(batch, frames):
+            if frame is None:
+                manifest.record(img_path, signatures[img_path], None)
+            else:
+                decoded.append((img_path, frame))
+        if not decoded:
+            continue
+        predictions = predict(
+            pose_model,
+            [frame for _, frame in decoded],
+            motion,
+            [os.path.dirname(img_path) for img_path, _ in decoded],
+        )
+        # We should use attempt to use information regarding the ground plane (avoid climbing stuff)
+        valid = gate.any_person(
+            [prediction.keypoints for prediction in predictions],
+            [frame.shape[0] for _, frame in decoded],
+        )
+        for (img_path, _), is_valid in zip(decoded, valid.tolist()):
+            manifest.record(img_path, signatures[img_path], is_valid)
 
 
-def process_frame_directory(input_dir: str, output_dir: str, margin: int = 10) -> None:
+def process_frame_directory(
+    input_dir: str,
+    output_dir: str,
+    margin: int = 10,
+    model_name: str = "yolov8n-pose.pt",
+    backend: str = "ultralytics",
+    batch_size: int = 16,
+    decode_workers: int = 4,
+    rescan: bool = False,
+    motion_screen: str | None = None,
+    motion_crop: bool = False,
+    require_head: bool = False,
+    upright: bool = False,
+) -> None:
     """
-    Process a directory of image frames, saving only those where a full person
-    is visible and touching the ground.
+    Process a directory of image frames or a frame store, saving only those where
+    a full person is visible and touching the ground. The classification of every
+    frame is kept in a manifest so a re-run only infers the new or changed frames.
 
     Args:
-        input_dir: Path to the input directory containing frame images.
+        input_dir: Path to the input directory containing frame images, or a `.frames` store.
         output_dir: Path to the output directory to save filtered frames.
+        margin: Margin from the bottom to consider foot uncropped.
+        model_name: Pose model path, an exported .onnx model for the onnxruntime and opencv backends.
+        backend: Inference backend running the pose model.
+        batch_size: Number of frames per pose model call.
+        decode_workers: Number of threads decoding the upcoming batches.
+        rescan: Whether to ignore the manifest and infer every frame again.
+        motion_screen: `mog2` or `diff` to skip the frames where nothing moved.
+        motion_crop: Whether the pose model only sees the moving region of the frames.
+        require_head: Whether the head of the person must be visible.
+        upright: Whether the torso of the person must be upright.
     """
-    # Use yolo for human detection
-    yolo_model = YOLO("yolov8n-pose.pt")
     # Create the output directory if not exists
     os.makedirs(output_dir, exist_ok=True)
-    image_files = sorted(
-        [
-            f
-            for f in os.listdir(input_dir)
-            if f.lower().endswith((".jpg", ".jpeg", ".png", ".bmp"))
-        ],
-    )
-    # Iterate over all the images
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    model = model_key(model_name)
+    gate = PersonGate(margin, require_head=require_head, upright=upright)
+    criteria = asdict(gate)
+    if motion_screen is not None:
+        # Frames skipped by the screen are recorded as invalid, a run with other
+        # motion settings (or without screen) must classify them again
+        criteria.update(motion_screen=motion_screen, motion_crop=motion_crop)
+    if rescan:
+        manifest = FrameManifest(manifest_path, model, criteria)
+    else:
+        manifest = FrameManifest.load(manifest_path, model, criteria)
+    img_paths = list_frames(input_dir)
+    signatures = {img_path: frame_signature(img_path) for img_path in img_paths}
+    manifest.prune(set(img_paths))
+    pending = [
+        img_path
+        for img_path in img_paths
+        if not manifest.is_current(img_path, signatures[img_path])
+    ]
+    print(
+        f"{len(img_paths) - len(pending)} frames already classified, "
+        f"{len(pending)} to infer",
+    )
+    count("frames_skipped", len(img_paths) - len(pending))
+    motion = None
+    if motion_screen is not None:
+        motion = MotionScreens(motion_screen, crop=motion_crop)
+    try:
+        if pending:
+            classify_frames(
+                pending,
+                signatures,
+                manifest,
+                gate,
+                load_backend(backend, model_name),
+                batch_size,
+                decode_workers,
+                motion,
+            )
+    finally:
+        # Keep the frames classified so far if the run is interrupted
+        manifest.save()
+    if motion is not None:
+        print(motion.summary())
     valid_imgs_json = []
     invalid_imgs_json = []
-    for _, fname in enumerate(image_files):
-        img_path = os.path.join(input_dir, fname)
-        frame = cv2.imread(img_path)
-        if frame is None:
-            continue
-        image_height, _ = frame.shape[:2]
-        results = yolo_model(frame)[0]
-        # If we use this with images in the wild we should add a is_upright_check
-        # We should use attempt to use information regarding the ground plane (avoid climbing stuff)
-        if is_whole_person_in_frame(results, image_height, margin):
+    for img_path in img_paths:
+        valid = manifest.is_valid(img_path)
+        if valid is True:
             valid_imgs_json.append(img_path)
-        else:
+        elif valid is False:
             invalid_imgs_json.append(img_path)
-    with open(
-        os.path.join(output_dir, "valid_filtered_imgs.json"),
-        "w",
-        encoding="utf-8",
-    ) as file:
-        file.write(json.dumps(valid_imgs_json))
-    with open(
-        os.path.join(output_dir, "invalid_filtered_imgs.json"),
-        "w",
-        encoding="utf-8",
-    ) as file:
-        file.write(json.dumps(invalid_imgs_json))
+    with timer("write"):
+        with open(
+            os.path.join(output_dir, "valid_filtered_imgs.json"),
+            "w",
+            encoding="utf-8",
+        ) as file:
+            file.write(json.dumps(valid_imgs_json))
+        with open(
+            os.path.join(output_dir, "invalid_filtered_imgs.json"),
+            "w",
+            encoding="utf-8",
+        ) as file:
+            file.write(json.dumps(invalid_imgs_json))
+    for name in ("valid_filtered_imgs.json", "invalid_filtered_imgs.json"):
+        count_file("bytes_written", os.path.join(output_dir, name))
     print(
-        f"Processed {len(image_files)} frames. Saved {len(valid_imgs_json)} valid frames to '{output_dir}'",
+        f"Processed {len(img_paths)} frames. Saved {len(valid_imgs_json)} valid frames to '{output_dir}'",
     )
 
 
@@ -113,7 +321,7 @@ def register_subparser(subparsers: argparse._SubParsersAction) -> None:
     parser.add_argument(
         "--input-dir",
         default=os.path.join("data", "original", "images"),
-        help="Directory containing image frames",
+        help="Directory containing image frames, or a .frames store",
     )
     parser.add_argument(
         "--output-dir",
@@ -125,6 +333,56 @@ def register_subparser(subparsers: argparse._SubParsersAction) -> None:
         default=10,
         help="Marging to tolerate against the image bottom edge",
     )
+    parser.add_argument(
+        "--model",
+        default="yolov8n-pose.pt",
+        help="YOLO pose model path, an exported .onnx model for the onnxruntime and opencv backends",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=list(BACKENDS),
+        default="ultralytics",
+        help="Inference backend running the pose model",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=16,
+        help="Number of frames per pose model call",
+    )
+    parser.add_argument(
+        "--decode-workers",
+        type=int,
+        default=4,
+        help="Number of threads decoding the upcoming frames",
+    )
+    parser.add_argument(
+        "--rescan",
+        action="store_true",
+        help=f"Ignore the {MANIFEST_NAME} of the output directory and infer every frame again",
+    )
+    parser.add_argument(
+        "--require-head",
+        action="store_true",
+        help="Also require the head of the person (nose, eyes or ears) to be visible",
+    )
+    parser.add_argument(
+        "--upright",
+        action="store_true",
+        help="Also require the torso of the person to be within 30 degrees of vertical",
+    )
+    parser.add_argument(
+        "--motion-screen",
+        choices=MOTION_METHODS,
+        default=None,
+        help="Skip the pose model on the frames where nothing moved since the previous frame, "
+        "with a MOG2 background model or frame differencing",
+    )
+    parser.add_argument(
+        "--motion-crop",
+        action="store_true",
+        help="With --motion-screen, run the pose model on the moving region of the frames only",
+    )
     parser.set_defaults(func=main)
     return parser
 
@@ -136,7 +394,20 @@ def main(args: argparse.Namespace) -> None:
     Args:
         args: Parsed command-line arguments.
     """
-    process_frame_directory(args.input_dir, args.output_dir, int(args.margin))
+    process_frame_directory(
+        args.input_dir,
+        args.output_dir,
+        int(args.margin),
+        args.model,
+        args.backend,
+        args.batch_size,
+        args.decode_workers,
+        args.rescan,
+        args.motion_screen,
+        args.motion_crop,
+        args.require_head,
+        args.upright,
+    )
 
 
 if __name__ == "__main__":
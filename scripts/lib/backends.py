@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import os
+from collections.abc import Callable
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+# Keypoints of the COCO pose models
+NUM_KEYPOINTS = 17
+
+
+@dataclass
+class Prediction:
+    """
+    Output of a detector for one image.
+
+    Attributes:
+        boxes: (M, 6) float32 array with [x_min, y_min, x_max, y_max, cls, conf].
+        keypoints: (M, K, 3) float32 array with [x, y, conf] of pose models, else None.
+    """
+
+    boxes: np.ndarray
+    keypoints: np.ndarray | None = None
+
+
+class InferenceBackend:
+    """
+    Runs a detection (or pose) model over batches of BGR images.
+
+    Args:
+        model_path (str): Model file, also identifies the weights of the detection cache.
+    """
+
+    name = ""
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+
+    def __call__(self, images: list[np.ndarray]) -> list[Prediction]:
+        raise NotImplementedError
+
+
+class UltralyticsBackend(InferenceBackend):
+    """PyTorch inference through ultralytics, for `.pt` weights and any exported format it loads."""
+
+    name = "ultralytics"
+
+    def __init__(self, model_path: str, threads: int | None = None):
+        import torch
+        from ultralytics import YOLO
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = YOLO(model_path)
+        super().__init__(getattr(self.model, "ckpt_path", None) or model_path)
+
+    def __call__(self, images: list[np.ndarray]) -> list[Prediction]:
+        predictions = []
+        for result in self.model(images, verbose=False):
+            boxes = np.concatenate(
+                [
+                    result.boxes.xyxy.cpu().numpy(),
+                    result.boxes.cls.cpu().numpy()[:, np.newaxis],
+                    result.boxes.conf.cpu().numpy()[:, np.newaxis],
+                ],
+                axis=1,
+            ).astype(np.float32)
+            keypoints = None
+            if result.keypoints is not None:
+                keypoints = result.keypoints.data.cpu().numpy().astype(np.float32)
+            predictions.append(Prediction(boxes, keypoints))
+        return predictions
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    Shared pre and post-processing of YOLOv8 models exported to ONNX
+    (`yolo export model=yolov8n.pt format=onnx`): letterboxing to the model
+    input size, decoding of the (4 + classes, anchors) output, or
+    (4 + 1 + 17 * 3, anchors) for pose models, and non-maximum suppression.
+
+    Args:
+        model_path (str): Exported `.onnx` model file.
+        imgsz (int): Input size the model was exported with.
+        conf (float): Minimum confidence of a detection.
+        iou (float): IoU threshold of the non-maximum suppression.
+    """
+
+    # Images per forward pass, None for the whole batch at once
+    max_batch: int | None = 1
+
+    def __init__(
+        self,
+        model_path: str,
+        imgsz: int = 640,
+        conf: float = 0.25,
+        iou: float = 0.45,
+    ):
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+        super().__init__(model_path)
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+
+    def forward(self, blob: np.ndarray) -> np.ndarray:
+        """Runs the model on a (N, 3, imgsz, imgsz) blob, returns the (N, C, anchors) output."""
+        raise NotImplementedError
+
+    def letterbox(self, image: np.ndarray) -> tuple[np.ndarray, float, float, float]:
+        """Resizes keeping the aspect ratio and pads to a square, returns the scale and padding."""
+        height, width = image.shape[:2]
+        scale = min(self.imgsz / height, self.imgsz / width)
+        resized_width, resized_height = round(width * scale), round(height * scale)
+        pad_x = (self.imgsz - resized_width) / 2
+        pad_y = (self.imgsz - resized_height) / 2
+        resized = cv2.resize(image, (resized_width, resized_height))
+        padded = cv2.copyMakeBorder(
+            resized,
+            round(pad_y - 0.1),
+            round(pad_y + 0.1),
+            round(pad_x - 0.1),
+            round(pad_x + 0.1),
+            cv2.BORDER_CONSTANT,
+            value=(114, 114, 114),
+        )
+        return padded, scale, round(pad_x - 0.1), round(pad_y - 0.1)
+
+    def postprocess(
+        self,
+        output: np.ndarray,
+        shape: tuple[int, int],
+        scale: float,
+        pad_x: float,
+        pad_y: float,
+    ) -> Prediction:
+        rows = output.T
+        pose = rows.shape[1] == 5 + NUM_KEYPOINTS * 3
+        if pose:
+            scores = rows[:, 4]
+            classes = np.zeros(len(rows), dtype=np.int32)
+        else:
+            class_scores = rows[:, 4:]
+            classes = class_scores.argmax(axis=1)
+            scores = class_scores[np.arange(len(rows)), classes]
+        keep = scores > self.conf
+        rows, scores, classes = rows[keep], scores[keep], classes[keep]
+        centers, sizes = rows[:, :2], rows[:, 2:4]
+        xywh = np.concatenate([centers - sizes / 2, sizes], axis=1)
+        indices = np.asarray(
+            cv2.dnn.NMSBoxesBatched(
+                xywh.tolist(),
+                scores.tolist(),
+                classes.tolist(),
+                self.conf,
+                self.iou,
+            ),
+            dtype=np.intp,
+        ).reshape(-1)
+        height, width = shape
+        offset = np.array([pad_x, pad_y], dtype=np.float32)
+        xyxy = np.concatenate(
+            [xywh[indices, :2], xywh[indices, :2] + sizes[indices]],
+            axis=1,
+        )
+        xyxy = (xyxy - np.tile(offset, 2)) / scale
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, width)
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, height)
+        boxes = np.concatenate(
+            [xyxy, classes[indices, np.newaxis], scores[indices, np.newaxis]],
+            axis=1,
+        ).astype(np.float32)
+        keypoints = None
+        if pose:
+            keypoints = (
+                rows[indices, 5:].reshape(-1, NUM_KEYPOINTS, 3).astype(np.float32)
+            )
+            keypoints[..., :2] = (keypoints[..., :2] - offset) / scale
+        return Prediction(boxes, keypoints)
+
+    def __call__(self, images: list[np.ndarray]) -> list[Prediction]:
+        predictions = []
+        step = self.max_batch or len(images)
+        for start in range(0, len(images), step):
+            chunk = images[start : start + step]
+            letterboxed = [self.letterbox(image) for image in chunk]
+            blob = cv2.dnn.blobFromImages(
+                [padded for padded, _, _, _ in letterboxed],
+                scalefactor=1 / 255,
+                swapRB=True,
+            )
+            outputs = self.forward(blob)
+            for image, output, (_, scale, pad_x, pad_y) in zip(
+                chunk,
+                outputs,
+                letterboxed,
+            ):
+                predictions.append(
+                    self.postprocess(output, image.shape[:2], scale, pad_x, pad_y),
+                )
+        return predictions
+
+
+class OnnxRuntimeBackend(OnnxBackend):
+    """ONNX Runtime CPU inference, batching the images when the model has a dynamic batch size."""
+
+    name = "onnxruntime"
+
+    def __init__(self, model_path: str, threads: int | None = None, **kwargs):
+        import onnxruntime
+
+        super().__init__(model_path, **kwargs)
+        session_options = onnxruntime.SessionOptions()
+        if threads:
+            session_options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            model_path,
+            session_options,
+            providers=["CPUExecutionProvider"],
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch_size, _, height, _ = model_input.shape
+        if isinstance(height, int):
+            self.imgsz = height
+        # Symbolic (dynamic) batch dimension
+        if not isinstance(batch_size, int):
+            self.max_batch = None
+
+    def forward(self, blob: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenCVDnnBackend(OnnxBackend):
+    """OpenCV DNN CPU inference, no dependency beyond OpenCV."""
+
+    name = "opencv"
+
+    def __init__(self, model_path: str, threads: int | None = None, **kwargs):
+        super().__init__(model_path, **kwargs)
+        if threads:
+            cv2.setNumThreads(threads)
+        self.net = cv2.dnn.readNetFromONNX(model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def forward(self, blob: np.ndarray) -> np.ndarray:
+        self.net.setInput(blob)
+        return self.net.forward()
+
+
+BACKENDS: dict[str, Callable[..., InferenceBackend]] = {
+    backend.name: backend
+    for backend in (UltralyticsBackend, OnnxRuntimeBackend, OpenCVDnnBackend)
+}
+
+
+def load_backend(
+    name: str,
+    model_path: str,
+    threads: int | None = None,
+) -> InferenceBackend:
+    """
+    Loads a model with the given inference backend.
+
+    Args:
+        name (str): One of `BACKENDS`: ultralytics, onnxruntime or opencv.
+        model_path (str): Model file, an exported `.onnx` for onnxruntime and opencv.
+        threads (int): Threads used by the backend, None for its default.
+    """
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown inference backend '{name}', expected one of {', '.join(BACKENDS)}",
+        )
+    return BACKENDS[name](model_path, threads=threads)
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import Literal
+
+import numpy as np
+
+# Formats of `write_columns`, json keeps the list of records as is
+OUTPUT_FORMATS = ("json", "npz", "npy")
+
+
+def record_key(record: dict) -> str:
+    """Identifies the image of a record: its path, or the video and frame index."""
+    if "image_path" in record:
+        return record["image_path"]
+    if "video" in record:
+        return f"{record['video']}#{record['frame_index']}"
+    return ""
+
+
+def to_columns(records: list[dict]) -> dict[str, np.ndarray]:
+    """
+    Converts prediction records to typed columns. Images and cameras are stored
+    once in the `image_paths` and `cameras` tables and referenced by index,
+    missing values are NaN.
+
+    Returns:
+        dict: `image_id` (int32), `camera_id` (int16), `bbox` (N x 4 float32),
+        `confidence` (float32), `pred_height` and `gt_height` (float64) columns,
+        and the `image_paths` and `cameras` tables.
+    """
+    images: dict[str, int] = {}
+    cameras: dict[str, int] = {}
+    size = len(records)
+    image_id = np.empty(size, dtype=np.int32)
+    camera_id = np.empty(size, dtype=np.int16)
+    bbox = np.full((size, 4), np.nan, dtype=np.float32)
+    confidence = np.full(size, np.nan, dtype=np.float32)
+    pred_height = np.full(size, np.nan, dtype=np.float64)
+    gt_height = np.full(size, np.nan, dtype=np.float64)
+    for i, record in enumerate(records):
+        image_id[i] = images.setdefault(record_key(record), len(images))
+        camera_id[i] = cameras.setdefault(record.get("intrinsics", ""), len(cameras))
+        box = record.get("pred_bbox", record.get("gt_bbox"))
+        if box is not None:
+            bbox[i] = box
+        if record.get("pred_conf") is not None:
+            confidence[i] = record["pred_conf"]
+        if record.get("pred_height") is not None:
+            pred_height[i] = record["pred_height"]
+        if record.get("gt_height") is not None:
+            gt_height[i] = record["gt_height"]
+    return {
+        "image_id": image_id,
+        "camera_id": camera_id,
+        "bbox": bbox,
+        "confidence": confidence,
+        "pred_height": pred_height,
+        "gt_height": gt_height,
+        "image_paths": np.array(list(images), dtype=str),
+        "cameras": np.array(list(cameras), dtype=str),
+    }
+
+
+def write_columns(path: str, records: list[dict], output_format: str = "npy") -> None:
+    """
+    Saves prediction records as columns.
+
+    Args:
+        path (str): `.npz` archive, or directory holding one `.npy` per column.
+        records (list[dict]): Prediction records.
+        output_format (str): `npz` for a single archive, `npy` for memory-mappable columns.
+    """
+    columns = to_columns(records)
+    if output_format == "npz":
+        np.savez(path, allow_pickle=False, **columns)
+        return
+    if output_format != "npy":
+        raise ValueError(f"Unknown columnar format: {output_format}")
+    os.makedirs(path, exist_ok=True)
+    for name, column in columns.items():
+        np.save(os.path.join(path, f"{name}.npy"), column)
+    with open(os.path.join(path, "columns.json"), "w", encoding="utf-8") as file:
+        json.dump({name: str(column.dtype) for name, column in columns.items()}, file)
+
+
+def read_columns(path: str, mmap: bool = True) -> dict[str, np.ndarray]:
+    """
+    Loads the columns saved by `write_columns`. The columns of a directory are
+    memory-mapped read-only, so only the pages touched by the analysis are read.
+
+    Example:
+        columns = read_columns("data/mydataset-estimation")
+        heights = columns["pred_height"][columns["camera_id"] == 0]
+    """
+    if os.path.isfile(path):
+        with np.load(path) as archive:
+            return {name: archive[name] for name in archive.files}
+    with open(os.path.join(path, "columns.json"), encoding="utf-8") as file:
+        names = json.load(file)
+    mmap_mode: Literal["r"] | None = "r" if mmap else None
+    return {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+        for name in names
+    }
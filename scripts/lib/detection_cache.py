@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from scripts.lib.frame_store import decode_frame_bytes
+from scripts.lib.frame_store import read_frame_bytes
+from scripts.lib.profiling import count
+from scripts.lib.profiling import timer
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """Returns the BLAKE2b hex digest of a file contents."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedSample:
+    """
+    A sample loaded through the detection cache.
+
+    Attributes:
+        key: Content hash of the encoded image.
+        detections: (M, 6) float32 array of [x_min, y_min, x_max, y_max, cls, conf]
+            person detections, None on a cache miss.
+        image: Decoded image, only present on a cache miss.
+        nbytes: Size of the encoded image in bytes.
+    """
+
+    key: str
+    detections: np.ndarray | None
+    image: cv2.typing.MatLike | None
+    nbytes: int
+
+
+class DetectionCache:
+    """
+    On-disk cache of person detections keyed by image content and model weights.
+    Entries are stored as `.npy` files under `<cache_dir>/<weights hash>/` and the
+    least recently used ones are evicted once the cache grows past `max_bytes`.
+
+    Args:
+        cache_dir (str): Directory holding the cache.
+        weights_path (str): Path to the model weights, their hash namespaces the entries.
+        max_bytes (int): Maximum size of the cache on disk.
+    """
+
+    def __init__(self, cache_dir: str, weights_path: str, max_bytes: int = 1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.model_dir = os.path.join(cache_dir, file_digest(weights_path))
+        os.makedirs(self.model_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        # path -> (mtime, size) for every entry of the cache (all models)
+        self._entries: dict[str, tuple[float, int]] = {}
+        for root, _, files in os.walk(cache_dir):
+            for name in files:
+                if name.endswith(".npy"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    self._entries[path] = (stat.st_mtime, stat.st_size)
+        self._size = sum(size for _, size in self._entries.values())
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.model_dir, key[:2], f"{key}.npy")
+
+    def load(self, sample: dict) -> CachedSample:
+        """
+        Reads and hashes the image of a sample, decoding it only on a cache miss.
+        The image may be a frame of a frame store, keyed by its encoded bytes.
+        Safe to call from several threads.
+        """
+        buffer = read_frame_bytes(sample["image_path"])
+        count("bytes_read", len(buffer))
+        key = hashlib.blake2b(buffer, digest_size=16).hexdigest()
+        path = self._path(key)
+        try:
+            detections = np.load(path)
+        except (OSError, ValueError):
+            detections = None
+        with self._lock:
+            if detections is not None:
+                self.hits += 1
+                self.bytes_saved += len(buffer)
+                self._touch(path)
+                return CachedSample(key, detections, None, len(buffer))
+            self.misses += 1
+        with timer("decode"):
+            image = decode_frame_bytes(sample["image_path"], buffer)
+        if image is None:
+            raise ValueError(f"Unable to decode the image: {sample['image_path']}")
+        return CachedSample(key, None, image, len(buffer))
+
+    def put(self, key: str, detections: np.ndarray) -> None:
+        """Stores the person detections of an image and evicts old entries if needed."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.save(file, np.asarray(detections, dtype=np.float32))
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._touch(path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _touch(self, path: str) -> None:
+        # Refresh the entry mtime so eviction is least recently used
+        try:
+            os.utime(path)
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        _, old_size = self._entries.get(path, (0, 0))
+        self._entries[path] = (stat.st_mtime, stat.st_size)
+        self._size += stat.st_size - old_size
+
+    def _evict(self) -> None:
+        # Evict down to 90% of the budget so we do not evict on every put
+        target = int(self.max_bytes * 0.9)
+        for path, (_, size) in sorted(self._entries.items(), key=lambda e: e[1][0]):
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            del self._entries[path]
+            self._size -= size
+
+    def summary(self) -> str:
+        return detection_cache_summary(self.hits, self.misses, self.bytes_saved)
+
+
+def detection_cache_summary(hits: int, misses: int, bytes_saved: int) -> str:
+    """Formats the hit ratio and bytes saved by a detection cache."""
+    total = hits + misses
+    hit_ratio = hits / total if total else 0.0
+    return (
+        f"Detection cache: {hits} hits, {misses} misses ({hit_ratio:.1%} hit ratio), "
+        f"{bytes_saved / 1e6:.1f} MB of images not decoded nor inferred"
+    )
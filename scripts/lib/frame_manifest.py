@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import json
+import os
+
+from scripts.lib.detection_cache import file_digest
+
+
+def model_key(model_name: str) -> str:
+    """Identifies a model by the hash of its weights, or by its name before it is downloaded."""
+    if os.path.isfile(model_name):
+        return file_digest(model_name)
+    return model_name
+
+
+class FrameManifest:
+    """
+    Classification of every frame of a directory, kept between runs so that
+    only new or changed frames go through the model again. A frame is
+    identified by its path and signature (see `frame_signature`), and the whole manifest
+    by the model and criteria it was built with: changing either starts over.
+
+    Args:
+        path (str): JSON file holding the manifest.
+        model (str): Model identifier, see `model_key`.
+        criteria (dict): Settings the frames were classified with (e.g. the margin).
+    """
+
+    def __init__(self, path: str, model: str, criteria: dict):
+        self.path = path
+        self.model = model
+        self.criteria = criteria
+        # frame path -> [*signature, valid], valid is None for unreadable frames
+        self.frames: dict[str, list] = {}
+
+    @classmethod
+    def load(cls, path: str, model: str, criteria: dict) -> FrameManifest:
+        manifest = cls(path, model, criteria)
+        if not os.path.isfile(path):
+            return manifest
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        if data.get("model") == model and data.get("criteria") == criteria:
+            manifest.frames = data["frames"]
+        return manifest
+
+    def is_current(self, frame_path: str, signature: list[int]) -> bool:
+        entry = self.frames.get(frame_path)
+        return entry is not None and entry[:-1] == signature
+
+    def is_valid(self, frame_path: str) -> bool | None:
+        """Whether the frame holds a whole person, None if it could not be read."""
+        return self.frames[frame_path][-1]
+
+    def record(self, frame_path: str, signature: list[int], valid: bool | None) -> None:
+        self.frames[frame_path] = [*signature, valid]
+
+    def prune(self, frame_paths: set[str]) -> None:
+        """Forgets the frames that are no longer in the directory."""
+        self.frames = {
+            path: entry for path, entry in self.frames.items() if path in frame_paths
+        }
+
+    def save(self) -> None:
+        """Atomically writes the manifest."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {"model": self.model, "criteria": self.criteria, "frames": self.frames},
+                file,
+            )
+        os.replace(tmp_path, self.path)
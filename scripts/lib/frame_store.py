@@ -0,0 +1,370 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import struct
+import threading
+import zlib
+from collections.abc import Iterator
+
+import cv2
+import numpy as np
+
+from scripts.lib.profiling import count
+from scripts.lib.profiling import count_file
+from scripts.lib.profiling import timer
+from scripts.lib.utils import LRUCache
+
+# A path ending with this extension is a frame store instead of a directory of
+# images, and `<store>/<frame name>` refers to one of its frames
+FRAME_STORE_EXTENSION = ".frames"
+# `raw` frames are stored as is and read without a copy from the memory-mapped file
+FRAME_CODECS = ("raw", "png", "jpg", "webp")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+MAGIC = b"FRMSTOR1"
+# Index offset and metadata length, followed by the magic
+TRAILER = struct.Struct("<QQ8s")
+INDEX_DTYPE = np.dtype(
+    [
+        ("offset", "<u8"),
+        ("size", "<u8"),
+        ("timestamp", "<f8"),
+        ("camera", "<u2"),
+        ("height", "<u4"),
+        ("width", "<u4"),
+        ("channels", "<u1"),
+        ("crc", "<u4"),
+    ],
+)
+
+
+def encode_params(codec: str, quality: int = 95, png_compression: int = 1) -> list[int]:
+    """cv2.imwrite parameters of an image format."""
+    if codec == "jpg":
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if codec == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    return [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+
+
+def is_frame_store(path: str) -> bool:
+    return path.endswith(FRAME_STORE_EXTENSION)
+
+
+class FrameStoreWriter:
+    """
+    Writes frames one after the other in a single file, followed by an index of
+    their offsets, shapes, timestamps and cameras. The file is written next to
+    its destination and moved in place by `close`.
+
+    Args:
+        path (str): Frame store to write, ending with `.frames`.
+        codec (str): `raw`, `png`, `jpg` or `webp`.
+        quality (int): JPEG or WebP quality.
+        png_compression (int): PNG compression level from 0 (fastest) to 9.
+
+    Example:
+        with FrameStoreWriter("data/cam1.frames", codec="jpg") as writer:
+            for index, timestamp, frame in iter_ffmpeg_frames("data/cam1.mkv", 1):
+                writer.append(frame, timestamp, camera="cam1")
+    """
+
+    def __init__(
+        self,
+        path: str,
+        codec: str = "png",
+        quality: int = 95,
+        png_compression: int = 1,
+    ):
+        if codec not in FRAME_CODECS:
+            raise ValueError(
+                f"Unknown codec '{codec}', expected one of {', '.join(FRAME_CODECS)}",
+            )
+        self.path = path
+        self.codec = codec
+        self.params = encode_params(codec, quality, png_compression)
+        self.names: list[str] = []
+        self.cameras: dict[str, int] = {}
+        self.entries: list[tuple] = []
+        self.tmp_path = f"{path}.tmp"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(MAGIC)
+        self.offset = len(MAGIC)
+
+    def encode(self, frame: np.ndarray) -> bytes:
+        """Encodes a frame with the codec of the store, safe to call from several threads."""
+        if self.codec == "raw":
+            return np.ascontiguousarray(frame).tobytes()
+        ok, buffer = cv2.imencode(f".{self.codec}", frame, self.params)
+        if not ok:
+            raise ValueError(f"Unable to encode a frame as {self.codec}")
+        return buffer.tobytes()
+
+    def append(
+        self,
+        frame: np.ndarray,
+        timestamp: float = math.nan,
+        camera: str = "",
+        name: str | None = None,
+    ) -> str:
+        """
+        Encodes and appends a frame.
+
+        Returns:
+            str: Name of the frame in the store, `frame_%05d` by default.
+        """
+        with timer("encode"):
+            data = self.encode(frame)
+        return self.append_encoded(data, frame.shape, timestamp, camera, name)
+
+    def append_encoded(
+        self,
+        data: bytes,
+        shape: tuple[int, ...],
+        timestamp: float = math.nan,
+        camera: str = "",
+        name: str | None = None,
+    ) -> str:
+        """Appends a frame already encoded with `encode`."""
+        name = name or f"frame_{len(self.names) + 1:05d}"
+        camera_id = self.cameras.setdefault(camera, len(self.cameras))
+        channels = shape[2] if len(shape) > 2 else 1
+        with timer("write"):
+            self.file.write(data)
+        self.entries.append(
+            (
+                self.offset,
+                len(data),
+                timestamp,
+                camera_id,
+                shape[0],
+                shape[1],
+                channels,
+                zlib.crc32(data),
+            ),
+        )
+        self.names.append(name)
+        self.offset += len(data)
+        count("bytes_written", len(data))
+        count("frames_written")
+        return name
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def close(self) -> None:
+        """Writes the index and moves the store in place."""
+        if self.file.closed:
+            return
+        metadata = json.dumps(
+            {"codec": self.codec, "cameras": list(self.cameras), "names": self.names},
+        ).encode()
+        index = np.array(self.entries, dtype=INDEX_DTYPE)
+        self.file.write(metadata)
+        self.file.write(index.tobytes())
+        self.file.write(TRAILER.pack(self.offset, len(metadata), MAGIC))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self) -> FrameStoreWriter:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        # The frames written before an error are kept, as for a directory
+        self.close()
+
+
+class FrameStore:
+    """
+    Reads a frame store written by `FrameStoreWriter`. The file is memory-mapped,
+    so a frame is decoded straight from the page cache, and `raw` frames are
+    returned as views without any copy.
+
+    Attributes:
+        codec: Codec of the frames.
+        names: Name of every frame.
+        index: Structured array with the offset, size, timestamp, camera id,
+            shape and CRC-32 of every frame.
+        cameras: Camera names, indexed by the camera id of the index.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        trailer = self.data[-TRAILER.size :].tobytes()
+        if (
+            self.data[: len(MAGIC)].tobytes() != MAGIC
+            or len(trailer) != TRAILER.size
+            or TRAILER.unpack(trailer)[2] != MAGIC
+        ):
+            raise ValueError(f"Not a frame store: {path}")
+        index_offset, metadata_length, _ = TRAILER.unpack(trailer)
+        metadata = json.loads(
+            self.data[index_offset : index_offset + metadata_length].tobytes(),
+        )
+        self.codec: str = metadata["codec"]
+        self.cameras: list[str] = metadata["cameras"]
+        self.names: list[str] = metadata["names"]
+        self.index = np.frombuffer(
+            self.data,
+            dtype=INDEX_DTYPE,
+            count=len(self.names),
+            offset=index_offset + metadata_length,
+        )
+        self.positions = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.index["timestamp"]
+
+    def camera(self, i: int) -> str:
+        return self.cameras[self.index["camera"][i]]
+
+    def encoded(self, i: int) -> np.ndarray:
+        """Encoded bytes of a frame, as a view of the file."""
+        offset, size = int(self.index["offset"][i]), int(self.index["size"][i])
+        return self.data[offset : offset + size]
+
+    def read(self, i: int) -> np.ndarray | None:
+        """Decodes a frame, a read-only view of the file for `raw` frames."""
+        count("bytes_read", int(self.index["size"][i]))
+        return self.decode(i)
+
+    def decode(self, i: int) -> np.ndarray | None:
+        """Like `read`, without counting the bytes read."""
+        data = self.encoded(i)
+        if self.codec == "raw":
+            entry = self.index[i]
+            shape = (int(entry["height"]), int(entry["width"]), int(entry["channels"]))
+            return np.asarray(data).reshape(shape if shape[2] > 1 else shape[:2])
+        return cv2.imdecode(np.asarray(data), cv2.IMREAD_UNCHANGED)
+
+    def read_name(self, name: str) -> np.ndarray | None:
+        return self.read(self.positions[name])
+
+    def signature(self, name: str) -> list[int]:
+        """Size and CRC-32 of a frame, which change only if the frame does."""
+        entry = self.index[self.positions[name]]
+        return [int(entry["size"]), int(entry["crc"])]
+
+    def as_array(self) -> np.ndarray:
+        """
+        All the frames of a `raw` store of fixed-size frames as a single (N, H, W, C)
+        array mapped on the file.
+        """
+        index = self.index
+        if self.codec != "raw" or not len(index):
+            raise ValueError(f"{self.path} does not hold raw frames")
+        shape = (
+            int(index["height"][0]),
+            int(index["width"][0]),
+            int(index["channels"][0]),
+        )
+        size = int(np.prod(shape))
+        expected = int(index["offset"][0]) + size * np.arange(len(index))
+        if (index["size"] != size).any() or (index["offset"] != expected).any():
+            raise ValueError(f"The frames of {self.path} do not have a fixed size")
+        start = int(index["offset"][0])
+        return self.data[start : start + size * len(index)].reshape(len(index), *shape)
+
+    def __iter__(self) -> Iterator[np.ndarray | None]:
+        for i in range(len(self)):
+            yield self.read(i)
+
+
+_STORES = LRUCache(maxsize=16)
+_STORES_LOCK = threading.Lock()
+
+
+def open_frame_store(path: str) -> FrameStore:
+    """Opens a frame store, reusing the one already opened while the file is unchanged."""
+    stat = os.stat(path)
+    with _STORES_LOCK:
+        return _STORES.get_or_set(
+            (path, stat.st_size, stat.st_mtime_ns),
+            lambda: FrameStore(path),
+        )
+
+
+def split_frame_path(path: str) -> tuple[str, str] | None:
+    """(store, frame name) of a `<store>/<frame name>` path, None for any other path."""
+    store_path, name = os.path.split(path)
+    if is_frame_store(store_path) and os.path.isfile(store_path):
+        return store_path, name
+    return None
+
+
+def list_frames(
+    source: str,
+    extensions: tuple[str, ...] = IMAGE_EXTENSIONS,
+) -> list[str]:
+    """
+    Paths of the frames of a directory of images or of a frame store, in order.
+    The frames of a store are listed as `<store>/<frame name>`, the files of a
+    directory only if they have one of the (lowercase) `extensions`.
+    """
+    if is_frame_store(source) and os.path.isfile(source):
+        return [os.path.join(source, name) for name in open_frame_store(source).names]
+    if not os.path.isdir(source):
+        raise NotADirectoryError(
+            f"Neither a directory nor a {FRAME_STORE_EXTENSION} store: {source}",
+        )
+    return [
+        os.path.join(source, name)
+        for name in sorted(os.listdir(source))
+        if name.lower().endswith(extensions)
+    ]
+
+
+def read_frame(path: str) -> np.ndarray | None:
+    """Decodes an image file or a `<store>/<frame name>` frame, None if it cannot be read."""
+    member = split_frame_path(path)
+    with timer("decode"):
+        if member is not None:
+            store_path, name = member
+            return open_frame_store(store_path).read_name(name)
+        frame = cv2.imread(path)
+    count_file("bytes_read", path)
+    return frame
+
+
+def read_frame_bytes(path: str) -> bytes:
+    """Encoded bytes of an image file or of a `<store>/<frame name>` frame."""
+    member = split_frame_path(path)
+    if member is not None:
+        store_path, name = member
+        store = open_frame_store(store_path)
+        return store.encoded(store.positions[name]).tobytes()
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def decode_frame_bytes(path: str, data: bytes) -> np.ndarray | None:
+    """Decodes the bytes returned by `read_frame_bytes` for the same path."""
+    member = split_frame_path(path)
+    if member is not None:
+        store_path, name = member
+        store = open_frame_store(store_path)
+        return store.decode(store.positions[name])
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def frame_signature(path: str) -> list[int]:
+    """
+    Identifies the content of a frame without reading it: size and modification
+    time of an image file, size and CRC-32 of a frame of a store.
+    """
+    member = split_frame_path(path)
+    if member is not None:
+        store_path, name = member
+        return open_frame_store(store_path).signature(name)
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import glob
+import math
+import os
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from scripts.lib.frame_store import encode_params
+from scripts.lib.frame_store import FRAME_CODECS
+from scripts.lib.frame_store import FrameStoreWriter
+from scripts.lib.frame_store import is_frame_store
+from scripts.lib.profiling import count
+from scripts.lib.profiling import count_file
+from scripts.lib.profiling import timer
+
+
+class FrameWriterPool:
+    """
+    Encodes and writes frames in a thread pool while the caller keeps decoding.
+    Frames are written as `frame_%05d.<codec>` images of a directory, or in
+    order in a frame store if `output_dir` ends with `.frames`. At most `depth`
+    frames wait for a worker, after which `submit` blocks on the oldest one, so
+    the memory held by pending frames stays bounded.
+
+    Args:
+        output_dir (str): Directory of the frames, or frame store.
+        codec (str): `png`, `jpg` or `webp`, also `raw` in a frame store.
+        quality (int): JPEG or WebP quality.
+        png_compression (int): PNG compression level from 0 (fastest) to 9.
+        workers (int): Number of encoding threads.
+        depth (int): Maximum number of pending frames, twice `workers` by default.
+        camera (str): Camera recorded with the frames of a frame store.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        codec: str = "png",
+        quality: int = 95,
+        png_compression: int = 1,
+        workers: int = 4,
+        depth: int | None = None,
+        camera: str = "",
+    ):
+        if workers < 1:
+            raise ValueError(f"workers must be positive, got {workers}")
+        self.store = None
+        if is_frame_store(output_dir):
+            self.store = FrameStoreWriter(output_dir, codec, quality, png_compression)
+        elif codec not in FRAME_CODECS or codec == "raw":
+            raise ValueError(f"Unknown image format for a directory: {codec}")
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+            for file in glob.glob(os.path.join(output_dir, f"frame_*.{codec}")):
+                os.remove(file)
+        self.output_dir = output_dir
+        self.codec = codec
+        self.params = encode_params(codec, quality, png_compression)
+        self.camera = camera
+        self.depth = depth or 2 * workers
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.pending: deque[tuple[Future, tuple[int, ...], float]] = deque()
+        self.submitted = 0
+        self.written = 0
+
+    def submit(self, frame: np.ndarray, timestamp: float = math.nan) -> None:
+        """Queues a frame, which must not be modified afterwards."""
+        if len(self.pending) >= self.depth:
+            with timer("write_wait"):
+                self._finish_oldest()
+        self.submitted += 1
+        future: Future
+        if self.store is not None:
+            future = self.pool.submit(self._encode, frame)
+        else:
+            path = os.path.join(
+                self.output_dir,
+                f"frame_{self.submitted:05d}.{self.codec}",
+            )
+            future = self.pool.submit(self._write, frame, path)
+        self.pending.append((future, frame.shape, timestamp))
+
+    def _encode(self, frame: np.ndarray) -> bytes:
+        assert self.store is not None
+        with timer("encode"):
+            return self.store.encode(frame)
+
+    def _write(self, frame: np.ndarray, path: str) -> None:
+        with timer("write"):
+            written = cv2.imwrite(path, frame, self.params)
+        if not written:
+            raise OSError(f"Unable to write the frame: {path}")
+        count_file("bytes_written", path)
+        count("frames_written")
+
+    def _finish_oldest(self) -> None:
+        future, shape, timestamp = self.pending.popleft()
+        result = future.result()
+        if self.store is not None:
+            self.store.append_encoded(result, shape, timestamp, self.camera)
+        self.written += 1
+
+    def close(self) -> None:
+        """Waits for the pending frames and finishes the frame store."""
+        try:
+            while self.pending:
+                self._finish_oldest()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+            if self.store is not None:
+                self.store.close()
+
+    def __enter__(self) -> FrameWriterPool:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
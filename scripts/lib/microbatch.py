@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future
+from typing import Any
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Groups concurrent requests into batches for a single worker thread. A batch
+    is closed once it holds `max_batch` items or `max_wait` seconds after its
+    first item arrived, so a lone request only waits `max_wait` while a burst
+    of requests shares one model call.
+
+    Args:
+        process (Callable): Function mapping a list of items to a list of results,
+            or to exceptions for the items that failed.
+        max_batch (int): Maximum number of items per batch.
+        max_wait (float): Seconds a batch waits for more items.
+        max_latencies (int): Number of recent request latencies kept for the metrics.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[list[Any]], list[Any]],
+        max_batch: int = 32,
+        max_wait: float = 0.01,
+        max_latencies: int = 4096,
+    ):
+        if max_batch < 1:
+            raise ValueError(f"max_batch must be positive, got {max_batch}")
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: queue.Queue[tuple[Any, Future, float]] = queue.Queue()
+        self._latencies: deque[float] = deque(maxlen=max_latencies)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.requests = 0
+        self.failures = 0
+        self.batches = 0
+        self.queue_depth_max = 0
+        self.busy = 0.0
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queues an item, the returned future holds its result."""
+        if self._stop.is_set():
+            raise RuntimeError("The batcher is closed")
+        future: Future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        with self._lock:
+            self.queue_depth_max = max(self.queue_depth_max, self._queue.qsize())
+        return future
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _next_batch(self) -> list[tuple[Any, Future, float]]:
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = max(deadline - time.perf_counter(), 0.0)
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                results = self.process([item for item, _, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            end = time.perf_counter()
+            with self._lock:
+                self.busy += end - start
+                self.batches += 1
+                self.requests += len(batch)
+                for (_, future, queued), result in zip(batch, results):
+                    self._latencies.append(end - queued)
+                    if isinstance(result, Exception):
+                        self.failures += 1
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        # Requests still queued when closing are not processed
+        while True:
+            try:
+                _, future, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            future.set_exception(RuntimeError("The batcher is closed"))
+
+    def metrics(self) -> dict:
+        """Request, batch, queue and latency counters since the batcher started."""
+        with self._lock:
+            latencies = np.asarray(self._latencies) * 1e3
+            wall = time.perf_counter() - self.started
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "batches": self.batches,
+                "mean_batch_size": (
+                    self.requests / self.batches if self.batches else 0.0
+                ),
+                "queue_depth": self._queue.qsize(),
+                "queue_depth_max": self.queue_depth_max,
+                "utilization": self.busy / wall if wall > 0 else 0.0,
+                "latency_p50_ms": (
+                    float(np.percentile(latencies, 50)) if len(latencies) else 0.0
+                ),
+                "latency_p99_ms": (
+                    float(np.percentile(latencies, 99)) if len(latencies) else 0.0
+                ),
+                "uptime_s": wall,
+            }
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import cv2
+import numpy as np
+
+from scripts.lib.backends import InferenceBackend
+from scripts.lib.backends import Prediction
+from scripts.lib.profiling import count
+from scripts.lib.profiling import timer
+
+MOTION_METHODS = ("mog2", "diff")
+
+
+class MotionScreen:
+    """
+    Finds the moving part of the frames of a static camera, on a downscaled
+    grayscale copy, either with a MOG2 background model or by differencing
+    each frame with a running average of the previous ones, which also catches
+    slow movements that barely change between consecutive frames. Frames must
+    be screened in temporal order.
+
+    Args:
+        method (str): `mog2` or `diff`.
+        width (int): Width the frames are downscaled to.
+        min_area (float): Fraction of the pixels that must be foreground.
+        threshold (int): Gray level difference of a moving pixel (`diff` only).
+        history (int): Frames the background is learned on.
+    """
+
+    def __init__(
+        self,
+        method: str = "mog2",
+        width: int = 160,
+        min_area: float = 0.001,
+        threshold: int = 25,
+        history: int = 200,
+    ):
+        if method not in MOTION_METHODS:
+            raise ValueError(
+                f"Unknown motion method '{method}', expected one of {', '.join(MOTION_METHODS)}",
+            )
+        self.method = method
+        self.width = width
+        self.min_area = min_area
+        self.threshold = threshold
+        self.kernel = np.ones((3, 3), dtype=np.uint8)
+        self.learning_rate = 1 / history
+        self.background: np.ndarray | None = None
+        self.subtractor = None
+        if method == "mog2":
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(
+                history=history,
+                detectShadows=False,
+            )
+
+    def foreground(self, frame: np.ndarray) -> tuple[int, int, int, int] | None:
+        """
+        Returns:
+            tuple | None: (x_min, y_min, x_max, y_max) box of the moving pixels in
+            frame coordinates, None if too few pixels moved.
+        """
+        height, width = frame.shape[:2]
+        scale = self.width / width
+        small = cv2.resize(
+            frame,
+            (self.width, max(round(height * scale), 1)),
+            interpolation=cv2.INTER_AREA,
+        )
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.subtractor is not None:
+            mask = self.subtractor.apply(small)
+        else:
+            if self.background is None or self.background.shape != small.shape:
+                # Nothing to compare the first frame with, it is kept whole
+                self.background = small.astype(np.float32)
+                return 0, 0, width, height
+            difference = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+            cv2.accumulateWeighted(small, self.background, self.learning_rate)
+            _, mask = cv2.threshold(
+                difference,
+                self.threshold,
+                255,
+                cv2.THRESH_BINARY,
+            )
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+        if cv2.countNonZero(mask) < self.min_area * mask.size:
+            return None
+        x, y, box_width, box_height = cv2.boundingRect(mask)
+        return (
+            int(x / scale),
+            int(y / scale),
+            min(int(np.ceil((x + box_width) / scale)), width),
+            min(int(np.ceil((y + box_height) / scale)), height),
+        )
+
+
+def expand_box(
+    box: tuple[int, int, int, int],
+    shape: tuple[int, ...],
+    padding: float,
+) -> tuple[int, int, int, int]:
+    """Grows a box by `padding` times its size on every side, within the image."""
+    x_min, y_min, x_max, y_max = box
+    pad_x = int((x_max - x_min) * padding)
+    pad_y = int((y_max - y_min) * padding)
+    return (
+        max(x_min - pad_x, 0),
+        max(y_min - pad_y, 0),
+        min(x_max + pad_x, shape[1]),
+        min(y_max + pad_y, shape[0]),
+    )
+
+
+class MotionScreens:
+    """
+    Skips the model on the frames where nothing moves, with one `MotionScreen`
+    per camera. With `crop`, the model only sees the moving region of the
+    other frames (grown by `padding`), and its boxes and keypoints are moved
+    back to frame coordinates.
+
+    Args:
+        method (str): `mog2` or `diff`, see `MotionScreen`.
+        crop (bool): Whether to run the model on the moving region only.
+        padding (float): Margin added around the moving region, relative to its size.
+        **kwargs: Settings of every `MotionScreen`.
+    """
+
+    def __init__(
+        self,
+        method: str = "mog2",
+        crop: bool = False,
+        padding: float = 0.25,
+        **kwargs,
+    ):
+        self.method = method
+        self.crop = crop
+        self.padding = padding
+        self.kwargs = kwargs
+        self.screens: dict[str, MotionScreen] = {}
+        self.screened = 0
+        self.skipped = 0
+
+    def foreground(
+        self,
+        camera: str,
+        frame: np.ndarray,
+    ) -> tuple[int, int, int, int] | None:
+        screen = self.screens.get(camera)
+        if screen is None:
+            screen = self.screens[camera] = MotionScreen(self.method, **self.kwargs)
+        with timer("motion"):
+            box = screen.foreground(frame)
+        self.screened += 1
+        if box is None:
+            self.skipped += 1
+            count("frames_skipped_motion")
+        return box
+
+    def select(
+        self,
+        frames: list[np.ndarray],
+        cameras: list[str],
+    ) -> tuple[list[int], list[np.ndarray], list[np.ndarray]]:
+        """
+        Screens a batch of frames.
+
+        Returns:
+            The indices of the frames where something moved, the images to run
+            the model on (the frames or their moving region) and their (x, y) offsets.
+        """
+        moving, inputs, offsets = [], [], []
+        for i, (camera, frame) in enumerate(zip(cameras, frames)):
+            box = self.foreground(camera, frame)
+            if box is None:
+                continue
+            moving.append(i)
+            if self.crop:
+                x_min, y_min, x_max, y_max = expand_box(box, frame.shape, self.padding)
+                inputs.append(frame[y_min:y_max, x_min:x_max])
+                offsets.append(np.array([x_min, y_min], dtype=np.float32))
+            else:
+                inputs.append(frame)
+                offsets.append(np.zeros(2, dtype=np.float32))
+        return moving, inputs, offsets
+
+    @staticmethod
+    def merge(
+        size: int,
+        moving: list[int],
+        predictions: list[Prediction],
+        offsets: list[np.ndarray],
+    ) -> list[Prediction]:
+        """Moves the predictions back to frame coordinates, with no detection for the skipped frames."""
+        merged = [Prediction(np.empty((0, 6), dtype=np.float32)) for _ in range(size)]
+        for i, prediction, offset in zip(moving, predictions, offsets):
+            prediction.boxes[:, :4] += np.tile(offset, 2)
+            if prediction.keypoints is not None:
+                prediction.keypoints[..., :2] += offset
+            merged[i] = prediction
+        return merged
+
+    def summary(self) -> str:
+        return (
+            f"Motion screen ({self.method}): {self.skipped} of {self.screened} "
+            "frames skipped without movement"
+        )
+
+
+def predict(
+    model: InferenceBackend,
+    frames: list[np.ndarray],
+    motion: MotionScreens | None = None,
+    cameras: list[str] | None = None,
+) -> list[Prediction]:
+    """
+    Runs the model over a batch of frames. With a motion screen the frames
+    where nothing moved get no detection without going through the model.
+
+    Args:
+        model (InferenceBackend): Detection or pose model.
+        frames (list[np.ndarray]): Decoded frames.
+        motion (MotionScreens): Optional motion screen.
+        cameras (list[str]): Camera of every frame, for the motion screen.
+    """
+    if motion is None:
+        with timer("inference"):
+            predictions = model(frames)
+        count("images_inferred", len(frames))
+        return predictions
+    moving, inputs, offsets = motion.select(frames, cameras or [""] * len(frames))
+    with timer("inference"):
+        predictions = model(inputs) if inputs else []
+    count("images_inferred", len(inputs))
+    return motion.merge(len(frames), moving, predictions, offsets)
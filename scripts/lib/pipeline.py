@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import Any
+
+# Marks the end of the stream in the queues
+_DONE = object()
+
+
+@dataclass
+class _Failure:
+    error: BaseException
+
+
+@dataclass
+class StageStats:
+    """Counters of a pipeline stage."""
+
+    name: str
+    items: int = 0
+    busy: float = 0.0
+    queue_depth_sum: int = 0
+    queue_depth_max: int = 0
+
+    def utilization(self, wall: float) -> float:
+        return self.busy / wall if wall > 0 else 0.0
+
+    def mean_queue_depth(self) -> float:
+        return self.queue_depth_sum / self.items if self.items else 0.0
+
+
+class Pipeline:
+    """
+    Runs each stage in its own thread, connected by bounded queues so every stage
+    works on a different item at the same time while at most `depth` items wait
+    between two stages. Items come out in input order.
+
+    Args:
+        stages (list[tuple[str, Callable]]): Named functions applied in order.
+        depth (int): Capacity of the queue feeding each stage.
+    """
+
+    def __init__(self, stages: list[tuple[str, Callable[[Any], Any]]], depth: int = 2):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        if depth < 1:
+            raise ValueError(f"depth must be positive, got {depth}")
+        self.stages = stages
+        self.depth = depth
+        self.stats = [StageStats(name) for name, _ in stages]
+        self.wall = 0.0
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        """Feeds `items` through the stages and yields the results of the last one."""
+        stop = threading.Event()
+        queues: list[queue.Queue] = [
+            queue.Queue(maxsize=self.depth) for _ in range(len(self.stages) + 1)
+        ]
+
+        def put(q: queue.Queue, item: Any) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def feed() -> None:
+            try:
+                for item in items:
+                    if not put(queues[0], item):
+                        return
+            except BaseException as e:
+                put(queues[0], _Failure(e))
+                return
+            put(queues[0], _DONE)
+
+        def work(index: int) -> None:
+            _, fn = self.stages[index]
+            stats = self.stats[index]
+            inbox, outbox = queues[index], queues[index + 1]
+            while not stop.is_set():
+                try:
+                    item = inbox.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE or isinstance(item, _Failure):
+                    put(outbox, item)
+                    return
+                # Items still waiting for this stage once it picks one up
+                depth = inbox.qsize()
+                stats.queue_depth_sum += depth
+                stats.queue_depth_max = max(stats.queue_depth_max, depth)
+                start = time.perf_counter()
+                try:
+                    result = fn(item)
+                except BaseException as e:
+                    result = _Failure(e)
+                stats.busy += time.perf_counter() - start
+                stats.items += 1
+                if not put(outbox, result):
+                    return
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        threads += [
+            threading.Thread(target=work, args=(i,), daemon=True)
+            for i in range(len(self.stages))
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall = time.perf_counter() - start
+
+    def summary(self) -> str:
+        return "\n".join(
+            f"Stage {stats.name}: {stats.items} items, "
+            f"{stats.utilization(self.wall):.1%} utilization, "
+            f"queue depth mean {stats.mean_queue_depth():.2f} max {stats.queue_depth_max}"
+            for stats in self.stats
+        )
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Iterator
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import TypeVar
+
+import cv2
+
+from scripts.lib.frame_store import read_frame
+
+T = TypeVar("T")
+
+
+def prefetch_batches(
+    batches: Iterable[list[T]],
+    load: Callable[[T], Any],
+    workers: int = 4,
+    depth: int = 2,
+) -> Iterator[tuple[list[T], list[Any]]]:
+    """
+    Loads the items of upcoming batches in a thread pool while the caller
+    consumes the current one. At most `depth` batches are loaded ahead, which
+    caps the memory held by decoded items.
+
+    Args:
+        batches (Iterable[list]): Batches of items to load.
+        load (Callable): Function applied to each item (e.g. cv2.imread on a path).
+        workers (int): Number of loader threads.
+        depth (int): Number of batches loaded ahead of the consumer.
+
+    Yields:
+        (batch, loaded): The original batch and the loaded items in the same order.
+    """
+    if workers < 1 or depth < 1:
+        raise ValueError(
+            f"workers and depth must be positive, got {workers} and {depth}",
+        )
+    pending: deque[tuple[list[T], list[Future]]] = deque()
+    iterator = iter(batches)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        def submit() -> bool:
+            batch = next(iterator, None)
+            if batch is None:
+                return False
+            pending.append((batch, [pool.submit(load, item) for item in batch]))
+            return True
+
+        for _ in range(depth):
+            if not submit():
+                break
+        while pending:
+            batch, futures = pending.popleft()
+            submit()
+            yield batch, [future.result() for future in futures]
+
+
+def read_image(sample: dict) -> cv2.typing.MatLike | None:
+    """
+    Returns the image of a sample: the already decoded `frame` (e.g. from a
+    video), which is removed from the sample so it is not kept nor serialized,
+    or else the image decoded from `image_path`, which may be a frame of a
+    frame store.
+    """
+    frame = sample.pop("frame", None)
+    if frame is not None:
+        return frame
+    return read_frame(sample["image_path"])
+
+
+def load_image(sample: dict) -> cv2.typing.MatLike:
+    """Like `read_image`, raising a ValueError if the image cannot be decoded."""
+    image = read_image(sample)
+    if image is None:
+        raise ValueError(f"Unable to decode the image: {sample['image_path']}")
+    return image
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+
+import numpy as np
+
+# Returned by `timer` while profiling is disabled, so a disabled timer costs a
+# function call and a flag check
+_DISABLED = contextlib.nullcontext()
+
+
+class Profiler:
+    """
+    Named timers and counters shared by the whole process. Disabled by default,
+    in which case `timer` and `count` return right away.
+
+    Example:
+        with PROFILER.timer("inference"):
+            model(images)
+        PROFILER.count("bytes_written", len(data))
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace = False
+        self.timings: defaultdict[str, list[float]] = defaultdict(list)
+        self.counters: defaultdict[str, float] = defaultdict(float)
+        self.events: list[dict] = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def enable(self, trace: bool = False, started: float | None = None) -> None:
+        """
+        Starts collecting, and keeps every timed span when `trace` is set. The
+        trace events are timed from `started`, now by default: a worker process
+        passes the origin of the main one, as `perf_counter` is system-wide, so
+        their events line up on the same timeline once merged.
+        """
+        self.enabled = True
+        self.trace = trace
+        self.started = time.perf_counter() if started is None else started
+
+    def timer(self, name: str) -> contextlib.AbstractContextManager:
+        if not self.enabled:
+            return _DISABLED
+        return self._timer(name)
+
+    @contextlib.contextmanager
+    def _timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.timings[name].append(end - start)
+                if self.trace:
+                    self.events.append(
+                        {
+                            "name": name,
+                            "ph": "X",
+                            "ts": (start - self.started) * 1e6,
+                            "dur": (end - start) * 1e6,
+                            "pid": os.getpid(),
+                            "tid": threading.get_ident(),
+                        },
+                    )
+
+    def count(self, name: str, value: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += value
+
+    def drain(self) -> dict:
+        """
+        Returns and clears what was collected so far, for a worker process to
+        send it to the main one, which passes it to `merge`.
+        """
+        with self._lock:
+            collected = {
+                "timings": dict(self.timings),
+                "counters": dict(self.counters),
+                "events": self.events,
+            }
+            self.timings = defaultdict(list)
+            self.counters = defaultdict(float)
+            self.events = []
+        return collected
+
+    def merge(self, collected: dict) -> None:
+        """Adds the timings, counters and events drained from another process."""
+        with self._lock:
+            for name, durations in collected["timings"].items():
+                self.timings[name].extend(durations)
+            for name, value in collected["counters"].items():
+                self.counters[name] += value
+            self.events.extend(collected["events"])
+
+    def summary(self) -> dict:
+        """Total, mean and p95 seconds of every timer, and the counters."""
+        with self._lock:
+            stages = {}
+            for name, durations in self.timings.items():
+                values = np.asarray(durations)
+                stages[name] = {
+                    "calls": len(values),
+                    "total_s": float(values.sum()),
+                    "mean_ms": float(values.mean() * 1e3),
+                    "p95_ms": float(np.percentile(values, 95) * 1e3),
+                    "max_ms": float(values.max() * 1e3),
+                }
+            return {
+                "wall_s": time.perf_counter() - self.started,
+                "stages": stages,
+                "counters": dict(self.counters),
+            }
+
+    def dump(self, path: str, trace_path: str | None = None) -> None:
+        """Writes the JSON summary and, if given, the Chrome trace-event file."""
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.summary(), file, indent=2)
+        print(f"Profile saved to: {path}")
+        if trace_path:
+            with open(trace_path, "w", encoding="utf-8") as file:
+                json.dump({"traceEvents": self.events}, file)
+            print(
+                f"Trace saved to: {trace_path} (open it in chrome://tracing or Perfetto)",
+            )
+
+
+PROFILER = Profiler()
+
+
+def timer(name: str) -> contextlib.AbstractContextManager:
+    """Times the enclosed block under `name` when profiling is enabled."""
+    return PROFILER.timer(name)
+
+
+def count(name: str, value: float = 1) -> None:
+    """Adds `value` to the counter `name` when profiling is enabled."""
+    PROFILER.count(name, value)
+
+
+def count_file(name: str, path: str) -> None:
+    """Adds the size of a file to the counter `name` when profiling is enabled."""
+    if PROFILER.enabled and os.path.isfile(path):
+        PROFILER.count(name, os.path.getsize(path))
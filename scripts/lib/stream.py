@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import sys
+import time
+from collections.abc import Iterable
+from collections.abc import Iterator
+from typing import Any
+from typing import Generic
+from typing import TypeVar
+
+T = TypeVar("T")
+
+
+def batched(iterable: Iterable[T], batch_size: int) -> Iterator[list[T]]:
+    """
+    Lazily groups an iterable into lists of `batch_size` items (the last one may be shorter).
+
+    Args:
+        iterable (Iterable): Items to group.
+        batch_size (int): Number of items per batch.
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be positive, got {batch_size}")
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def current_rss() -> int | None:
+    """Resident set size of this process in bytes, None where /proc is not available."""
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss() -> int | None:
+    """Peak resident set size of this process in bytes, None where it is not available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class AdaptiveBatcher(Generic[T]):
+    """
+    Lazily groups an iterable into batches, like `batched`, holding a single
+    batch at a time. With a `target_latency` the size of the next batches
+    adapts to the processing time reported through `observe`: it doubles while
+    a batch would still finish within the target and halves when it does not,
+    or when the resident memory of the process exceeds `max_rss`.
+
+    Example:
+        batcher = AdaptiveBatcher(records, 32, target_latency=1.0)
+        for batch in batcher.observe(process_batches(batcher)):
+            ...
+
+    Args:
+        iterable (Iterable): Items to group.
+        batch_size (int): Number of items per batch, the initial one in dynamic mode.
+        target_latency (float): Seconds a batch should take, None for a fixed size.
+        max_batch_size (int): Largest batch of the dynamic mode.
+        max_rss (float): Resident memory in bytes above which batches shrink.
+    """
+
+    def __init__(
+        self,
+        iterable: Iterable[T],
+        batch_size: int,
+        target_latency: float | None = None,
+        max_batch_size: int = 1024,
+        max_rss: float | None = None,
+    ):
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        self.iterable = iterable
+        self.batch_size = batch_size
+        self.target_latency = target_latency
+        self.max_batch_size = max(max_batch_size, batch_size)
+        self.max_rss = max_rss
+        self.sizes: list[int] = []
+        self._last: float | None = None
+
+    def __iter__(self) -> Iterator[list[T]]:
+        iterator = iter(self.iterable)
+        while batch := list(itertools.islice(iterator, self.batch_size)):
+            self.sizes.append(len(batch))
+            yield batch
+
+    def observe(self, results: Iterable[list[T]]) -> Iterator[list[T]]:
+        """Passes the processed batches through, resizing the next batches as they finish."""
+        for batch in results:
+            now = time.perf_counter()
+            # The first batch also pays for the warm-up, it only starts the clock
+            if self._last is not None and batch:
+                self.resize((now - self._last) / len(batch))
+            self._last = now
+            yield batch
+
+    def resize(self, seconds_per_item: float) -> None:
+        target = self.target_latency
+        if target is None:
+            return
+        max_rss = self.max_rss
+        if max_rss is not None and (current_rss() or 0) > max_rss:
+            self.batch_size = max(self.batch_size // 2, 1)
+        elif seconds_per_item * self.batch_size > target:
+            self.batch_size = max(self.batch_size // 2, 1)
+        elif seconds_per_item * self.batch_size * 2 <= target:
+            self.batch_size = min(self.batch_size * 2, self.max_batch_size)
+
+    def summary(self) -> str:
+        if not self.sizes:
+            return "Batches: none"
+        return (
+            f"Batches: {len(self.sizes)}, size min {min(self.sizes)}, "
+            f"mean {sum(self.sizes) / len(self.sizes):.1f}, max {max(self.sizes)}"
+        )
+
+
+def iter_jsonl(path: str, skip: int = 0) -> Iterator[dict]:
+    """
+    Lazily reads the records of a JSON Lines file, ignoring blank lines.
+
+    Args:
+        path (str): Path to the JSONL file.
+        skip (int): Number of leading records to skip (e.g. already processed).
+    """
+    with open(path, encoding="utf-8") as file:
+        records = (json.loads(line) for line in file if line.strip())
+        yield from itertools.islice(records, skip, None)
+
+
+def read_checkpoint(path: str) -> dict[str, Any]:
+    """
+    Reads a streaming checkpoint.
+
+    Returns:
+        dict: `records` already processed and the output `offset` in bytes they span.
+    """
+    if not os.path.isfile(path):
+        return {"records": 0, "offset": 0}
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def write_checkpoint(path: str, records: int, offset: int) -> None:
+    """
+    Atomically writes a streaming checkpoint.
+
+    Args:
+        path (str): Path to the checkpoint file.
+        records (int): Number of input records fully processed.
+        offset (int): Size in bytes of the output holding those records.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump({"records": records, "offset": offset}, file)
+    os.replace(tmp_path, path)
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Pairwise intersection over union of two sets of boxes.
+
+    Args:
+        boxes_a (np.ndarray): (N, 4) boxes (x_min, y_min, x_max, y_max).
+        boxes_b (np.ndarray): (M, 4) boxes (x_min, y_min, x_max, y_max).
+
+    Returns:
+        np.ndarray: (N, M) IoU of every pair.
+    """
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(1, -1, 4)
+    top_left = np.maximum(a[..., :2], b[..., :2])
+    bottom_right = np.minimum(a[..., 2:], b[..., 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=-1)
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - intersection
+    return np.divide(intersection, union, out=np.zeros_like(union), where=union > 0)
+
+
+def match_boxes(
+    boxes_a: np.ndarray,
+    boxes_b: np.ndarray,
+    iou_threshold: float = 0.3,
+) -> list[tuple[int, int]]:
+    """Greedily pairs the boxes of both sets by decreasing IoU, above `iou_threshold`."""
+    iou = iou_matrix(boxes_a, boxes_b)
+    matches = []
+    used_a: set[int] = set()
+    used_b: set[int] = set()
+    for flat in np.argsort(-iou, axis=None):
+        i, j = np.unravel_index(flat, iou.shape)
+        if iou[i, j] < iou_threshold:
+            break
+        if i not in used_a and j not in used_b:
+            matches.append((int(i), int(j)))
+            used_a.add(int(i))
+            used_b.add(int(j))
+    return matches
+
+
+@dataclass
+class Track:
+    """A person followed across frames."""
+
+    track_id: int
+    box: np.ndarray
+    # Detection frames in a row without a matching detection
+    misses: int = 0
+    # Propagation failed, the box is kept only to be re-associated
+    lost: bool = False
+
+
+class MedianFlowTracker:
+    """
+    Follows people between detector runs. Boxes are propagated frame to frame
+    with pyramidal Lucas-Kanade optical flow on a grid of points inside each box
+    (median shift and scale of the points passing the forward-backward check),
+    and associated to the detections by IoU when the detector runs again.
+    A track whose points cannot be followed is marked lost, which asks for a
+    detection on the next frame.
+
+    Args:
+        iou_threshold (float): Minimum IoU between a track and a detection to match.
+        max_misses (int): Detection frames a track may go unmatched before it ends.
+        grid_size (int): Points per side of the grid followed inside a box.
+        min_points (int): Minimum points passing the forward-backward check.
+        max_fb_error (float): Maximum forward-backward error in pixels of a point.
+    """
+
+    def __init__(
+        self,
+        iou_threshold: float = 0.3,
+        max_misses: int = 1,
+        grid_size: int = 10,
+        min_points: int = 10,
+        max_fb_error: float = 1.0,
+    ):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.grid_size = grid_size
+        self.min_points = min_points
+        self.max_fb_error = max_fb_error
+        self.tracks: list[Track] = []
+        self.next_id = 0
+        self.previous: np.ndarray | None = None
+
+    @property
+    def active(self) -> list[Track]:
+        return [track for track in self.tracks if not track.lost]
+
+    @property
+    def needs_detection(self) -> bool:
+        return any(track.lost for track in self.tracks)
+
+    def update(self, gray: np.ndarray, boxes: np.ndarray) -> None:
+        """Associates the detections of a frame to the tracks, starting and ending tracks."""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        matches = match_boxes(
+            np.array([track.box for track in self.tracks]).reshape(-1, 4),
+            boxes,
+            self.iou_threshold,
+        )
+        matched = {j for _, j in matches}
+        for i, j in matches:
+            track = self.tracks[i]
+            track.box, track.misses, track.lost = boxes[j], 0, False
+        for i in set(range(len(self.tracks))) - {i for i, _ in matches}:
+            self.tracks[i].misses += 1
+            self.tracks[i].lost = True
+        self.tracks = [
+            track for track in self.tracks if track.misses <= self.max_misses
+        ]
+        for j in range(len(boxes)):
+            if j not in matched:
+                self.tracks.append(Track(self.next_id, boxes[j]))
+                self.next_id += 1
+        self.previous = gray
+
+    def propagate(self, gray: np.ndarray) -> None:
+        """Moves the active tracks to the current frame with optical flow."""
+        tracks = self.active
+        if self.previous is None or not tracks:
+            self.previous = gray
+            return
+        grid = np.linspace(0.1, 0.9, self.grid_size)
+        offsets = np.stack(np.meshgrid(grid, grid), axis=-1).reshape(-1, 2)
+        boxes = np.array([track.box for track in tracks])
+        # (T, P, 2) points of every track followed in a single call
+        points = boxes[:, np.newaxis, :2] + offsets * (
+            boxes[:, np.newaxis, 2:] - boxes[:, np.newaxis, :2]
+        )
+        flat = points.reshape(-1, 1, 2).astype(np.float32)
+        # Output buffers of the tracked points, their initial value is ignored
+        forward, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.previous,
+            gray,
+            flat,
+            np.empty_like(flat),
+            winSize=(15, 15),
+            maxLevel=3,
+        )
+        backward, back_status, _ = cv2.calcOpticalFlowPyrLK(
+            gray,
+            self.previous,
+            forward,
+            np.empty_like(flat),
+            winSize=(15, 15),
+            maxLevel=3,
+        )
+        fb_error = np.linalg.norm(flat - backward, axis=-1)
+        good = (status == 1) & (back_status == 1) & (fb_error < self.max_fb_error)
+        good = good.reshape(len(tracks), -1)
+        moved = forward.reshape(len(tracks), -1, 2).astype(np.float64)
+        for track, before, after, valid in zip(tracks, points, moved, good):
+            if valid.sum() < self.min_points:
+                track.lost = True
+                continue
+            before, after = before[valid], after[valid]
+            shift = np.median(after - before, axis=0)
+            # Scale change from the distances between pairs of points
+            i, j = np.triu_indices(len(before), k=1)
+            distance_before = np.linalg.norm(before[i] - before[j], axis=-1)
+            distance_after = np.linalg.norm(after[i] - after[j], axis=-1)
+            nonzero = distance_before > 0
+            scale = float(np.median(distance_after[nonzero] / distance_before[nonzero]))
+            center = (track.box[:2] + track.box[2:]) / 2 + shift
+            half_size = (track.box[2:] - track.box[:2]) / 2 * scale
+            track.box = np.concatenate([center - half_size, center + half_size])
+        self.previous = gray
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+
+import cv2
+import numpy as np
+
+
+def camera_key(K: np.ndarray, DC: np.ndarray) -> bytes:
+    """Identifies a camera by its intrinsics and distortion coefficients."""
+    return (
+        np.asarray(K, dtype=np.float64).tobytes()
+        + np.asarray(DC, dtype=np.float64).ravel().tobytes()
+    )
+
+
+class UndistortionMap:
+    """
+    Dense lookup table from distorted to undistorted pixel coordinates of a camera.
+    The table samples the image every `step` pixels (below 1 for sub-pixel
+    resolution) and points are interpolated bilinearly, so undistorting becomes
+    an array gather instead of the iterative solve of `cv2.undistortPoints`.
+    Points outside the table fall back to `cv2.undistortPoints`.
+
+    Args:
+        table (np.ndarray): (H, W, 2) undistorted coordinates of the grid points.
+        step (float): Distance in pixels between two grid points.
+        K (np.ndarray): Camera intrinsic matrix (3x3).
+        DC (np.ndarray): OpenCV distortion coefficients.
+    """
+
+    def __init__(self, table: np.ndarray, step: float, K: np.ndarray, DC: np.ndarray):
+        self.table = table
+        self.step = step
+        self.K = np.asarray(K, dtype=np.float64)
+        self.DC = np.asarray(DC, dtype=np.float64)
+        self.max_error = 0.0
+
+    @classmethod
+    def build(
+        cls,
+        K: np.ndarray,
+        DC: np.ndarray,
+        step: float = 1.0,
+        image_size: tuple[int, int] | None = None,
+    ) -> UndistortionMap:
+        """
+        Builds the table with a single `cv2.undistortPoints` call over the grid.
+
+        Args:
+            K (np.ndarray): Camera intrinsic matrix (3x3).
+            DC (np.ndarray): OpenCV distortion coefficients.
+            step (float): Distance in pixels between two grid points.
+            image_size (tuple[int, int]): (width, height) covered by the table,
+                twice the principal point by default.
+        """
+        if step <= 0:
+            raise ValueError(f"step must be positive, got {step}")
+        K = np.asarray(K, dtype=np.float64)
+        if image_size is None:
+            image_size = (math.ceil(2 * K[0, 2]), math.ceil(2 * K[1, 2]))
+        width, height = image_size
+        xs = np.arange(0, width + step, step, dtype=np.float64)
+        ys = np.arange(0, height + step, step, dtype=np.float64)
+        grid = np.stack(np.meshgrid(xs, ys), axis=-1)
+        undistorted = cv2.undistortPoints(
+            grid.reshape(-1, 1, 2),
+            K,
+            np.asarray(DC, dtype=np.float64),
+            P=K,
+        )
+        table = undistorted.reshape(len(ys), len(xs), 2).astype(np.float32)
+        return cls(table, step, K, DC)
+
+    def undistort(self, points: np.ndarray) -> np.ndarray:
+        """
+        Undistorts pixel coordinates.
+
+        Args:
+            points (np.ndarray): (N, 2) distorted pixel coordinates.
+
+        Returns:
+            np.ndarray: (N, 2) undistorted pixel coordinates.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        rows, cols = self.table.shape[:2]
+        u = points[:, 0] / self.step
+        v = points[:, 1] / self.step
+        inside = (u >= 0) & (v >= 0) & (u <= cols - 1) & (v <= rows - 1)
+        u0 = np.clip(np.floor(u).astype(np.intp), 0, cols - 2)
+        v0 = np.clip(np.floor(v).astype(np.intp), 0, rows - 2)
+        du = (u - u0)[:, np.newaxis]
+        dv = (v - v0)[:, np.newaxis]
+        table = self.table
+        result = (
+            table[v0, u0] * (1 - du) * (1 - dv)
+            + table[v0, u0 + 1] * du * (1 - dv)
+            + table[v0 + 1, u0] * (1 - du) * dv
+            + table[v0 + 1, u0 + 1] * du * dv
+        )
+        if not inside.all():
+            outside = ~inside
+            result[outside] = cv2.undistortPoints(
+                points[outside].reshape(-1, 1, 2),
+                self.K,
+                self.DC,
+                P=self.K,
+            ).reshape(-1, 2)
+        return result
+
+    def validate(self, num_points: int = 2000, seed: int = 0) -> float:
+        """
+        Compares the table against `cv2.undistortPoints` on random points.
+
+        Returns:
+            float: Maximum error in pixels, also kept as `max_error`.
+        """
+        rows, cols = self.table.shape[:2]
+        rng = np.random.default_rng(seed)
+        points = rng.uniform(
+            0,
+            [(cols - 1) * self.step, (rows - 1) * self.step],
+            size=(num_points, 2),
+        )
+        expected = cv2.undistortPoints(
+            points.reshape(-1, 1, 2),
+            self.K,
+            self.DC,
+            P=self.K,
+        ).reshape(-1, 2)
+        self.max_error = float(np.abs(self.undistort(points) - expected).max())
+        return self.max_error
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            table=self.table,
+            step=self.step,
+            key=np.frombuffer(camera_key(self.K, self.DC), dtype=np.uint8),
+            max_error=self.max_error,
+        )
+
+    @classmethod
+    def load(cls, path: str, K: np.ndarray, DC: np.ndarray, step: float):
+        """Loads a persisted table, None if it is missing or was built for another camera or step."""
+        if not os.path.isfile(path):
+            return None
+        key = camera_key(K, DC)
+        with np.load(path) as data:
+            if float(data["step"]) != step or data["key"].tobytes() != key:
+                return None
+            undistortion_map = cls(data["table"], step, K, DC)
+            undistortion_map.max_error = float(data["max_error"])
+        return undistortion_map
+
+
+def undistortion_map_path(intrinsics_path: str, step: float) -> str:
+    """Path of the table persisted next to the intrinsics file."""
+    root, _ = os.path.splitext(intrinsics_path)
+    digest = hashlib.blake2b(str(step).encode(), digest_size=4).hexdigest()
+    return f"{root}.undistort-{digest}.npz"
+
+
+class UndistortionMaps:
+    """
+    Registry of the undistortion tables of the cameras in use. Until `enable`
+    is called with a step, nothing is built and `get` always returns None.
+
+    Args:
+        tolerance (float): Maximum error in pixels against `cv2.undistortPoints`
+            for a table to be used.
+    """
+
+    def __init__(self, tolerance: float = 0.05):
+        self.tolerance = tolerance
+        self.step: float | None = None
+        self._maps: dict[bytes, UndistortionMap | None] = {}
+
+    def enable(self, step: float | None) -> None:
+        if step != self.step:
+            self.step = step
+            self._maps.clear()
+
+    def register(self, intrinsics_path: str, K: np.ndarray, DC: np.ndarray) -> None:
+        """Loads (or builds and persists next to the intrinsics) the table of a camera."""
+        if self.step is None:
+            return
+        key = camera_key(K, DC)
+        if key in self._maps:
+            return
+        path = undistortion_map_path(intrinsics_path, self.step)
+        undistortion_map = UndistortionMap.load(path, K, DC, self.step)
+        if undistortion_map is None:
+            undistortion_map = UndistortionMap.build(K, DC, self.step)
+            undistortion_map.validate()
+            try:
+                undistortion_map.save(path)
+            except OSError as e:
+                print(f"Unable to save the undistortion map '{path}': {e}")
+        if undistortion_map.max_error > self.tolerance:
+            print(
+                f"Undistortion map of '{intrinsics_path}' is off by up to "
+                f"{undistortion_map.max_error:.3f}px, using cv2.undistortPoints instead",
+            )
+            self._maps[key] = None
+            return
+        self._maps[key] = undistortion_map
+
+    def get(self, K: np.ndarray, DC: np.ndarray) -> UndistortionMap | None:
+        if self.step is None or not self._maps:
+            return None
+        return self._maps.get(camera_key(K, DC))
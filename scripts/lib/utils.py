@@ -1,6 +1,10 @@
 from __future__ import annotations
 
 import argparse
+from collections import OrderedDict
+from typing import Any
+from typing import Callable
+from typing import NamedTuple
 
 import numpy as np
 import yaml
@@ -58,6 +62,81 @@ def load_camera_parameters(yaml_path: str):
     }
 
 
+def load_extrinsics(yaml_path: str) -> dict:
+    """Loads the camera pose of an extrinsics YAML file.
+
+    Args:
+        yaml_path (str): Path to the YAML file.
+
+    Returns:
+        dict: `camera_height`, `camera_pitch`, `camera_yaw` and `distance` as used by the estimation samples.
+    """
+    with open(yaml_path) as file:
+        data = yaml.safe_load(file)
+
+    return {
+        "camera_height": data["camera_height"],
+        "camera_pitch": data["camera_pitch"],
+        "camera_yaw": data.get("camera_yaw", 0.0),
+        "distance": data.get("distance", data.get("distance_to_object")),
+    }
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class LRUCache:
+    """Bounded in-process cache with least-recently-used eviction.
+
+    Args:
+        maxsize (int): Maximum number of entries kept before evicting.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be positive, got {maxsize}")
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_set(self, key: Any, factory: Callable[[], Any]) -> Any:
+        """Returns the cached value for `key`, computing it with `factory` on a miss."""
+        if key in self._data:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+        self.misses += 1
+        value = factory()
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(
+            self.hits,
+            self.misses,
+            self.evictions,
+            self.maxsize,
+            len(self._data),
+        )
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
 def load_yaml_defaults(parser: argparse.ArgumentParser, config_file: str):
     if config_file:
         with open(config_file) as f:
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import io
+import json
+import subprocess
+from collections.abc import Iterator
+
+import cv2
+import numpy as np
+
+from scripts.lib.profiling import count
+from scripts.lib.profiling import timer
+
+# Decoders of `iter_frames`
+VIDEO_DECODERS = ("opencv", "ffmpeg")
+
+
+def iter_video_frames(
+    video_path: str,
+    rate: float | None = None,
+) -> Iterator[tuple[int, float, np.ndarray]]:
+    """
+    Decodes a video in-process, sampling `rate` frames per second.
+    Frames that are not sampled are only grabbed (demuxed) and never converted.
+
+    Args:
+        video_path (str): Path to the video file.
+        rate (float): Frames per second to keep, None keeps every frame.
+
+    Yields:
+        (index, timestamp, frame): Frame index in the video, timestamp in seconds
+        and the BGR frame.
+    """
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise FileNotFoundError(f"Unable to open video: {video_path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+    interval = 1.0 / rate if rate else 0.0
+    next_capture_time = 0.0
+    index = 0
+    try:
+        while capture.grab():
+            timestamp = (
+                index / fps if fps > 0 else capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            )
+            if timestamp + 1e-9 >= next_capture_time:
+                with timer("video_decode"):
+                    ok, frame = capture.retrieve()
+                if ok:
+                    yield index, timestamp, frame
+                next_capture_time += interval
+            index += 1
+    finally:
+        capture.release()
+
+
+def probe_video(video_path: str) -> tuple[int, int, float]:
+    """
+    Reads the size and frame rate of the first video stream with ffprobe.
+
+    Returns:
+        (width, height, fps): Size of the decoded frames, once rotated, and the
+        average frame rate (0 if unknown).
+    """
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=width,height,avg_frame_rate:stream_tags=rotate:stream_side_data=rotation",
+        "-of",
+        "json",
+        video_path,
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True)
+    streams = json.loads(output.stdout).get("streams")
+    if not streams:
+        raise ValueError(f"No video stream in {video_path}")
+    stream = streams[0]
+    width, height = stream["width"], stream["height"]
+    rotation = stream.get("tags", {}).get("rotate", 0)
+    for side_data in stream.get("side_data_list", []):
+        rotation = side_data.get("rotation", rotation)
+    # ffmpeg applies the rotation of the stream when decoding
+    if int(float(rotation)) % 180 != 0:
+        width, height = height, width
+    numerator, _, denominator = stream.get("avg_frame_rate", "0/1").partition("/")
+    fps = float(numerator) / float(denominator) if float(denominator or 0) else 0.0
+    return width, height, fps
+
+
+def probe_keyframes(video_path: str) -> tuple[list[float], float]:
+    """
+    Lists the keyframes of the first video stream with ffprobe, from the packet
+    flags so nothing is decoded.
+
+    Returns:
+        (keyframes, duration): Keyframe timestamps and duration in seconds, both
+        relative to the start of the file as ffmpeg counts them.
+    """
+    output = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=start_time,duration",
+            "-of",
+            "json",
+            video_path,
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    file_format = json.loads(output.stdout)["format"]
+    start_time = float(file_format.get("start_time", 0.0))
+    output = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,flags",
+            "-of",
+            "csv=p=0",
+            video_path,
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    keyframes = []
+    for line in output.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time) - start_time)
+    return sorted(keyframes), float(file_format.get("duration", 0.0))
+
+
+def read_exactly(stream: io.BufferedIOBase, view: memoryview) -> int:
+    """Fills `view` from the stream, returns the number of bytes read (short at the end)."""
+    filled = 0
+    while filled < len(view):
+        read = stream.readinto(view[filled:])
+        if not read:
+            break
+        filled += read
+    return filled
+
+
+def iter_ffmpeg_frames(
+    video_path: str,
+    rate: float | None = None,
+    copy: bool = False,
+) -> Iterator[tuple[int, float, np.ndarray]]:
+    """
+    Decodes a video with an ffmpeg process writing raw BGR frames to a pipe,
+    without encoding any image. With a `rate`, frames are resampled by the
+    ffmpeg `fps` filter, as `extract-frames` does.
+
+    The frames are read into a single buffer reused for every frame, so a
+    frame is only valid until the next one is read: pass `copy` to keep them.
+
+    Args:
+        video_path (str): Path to the video file.
+        rate (float): Frames per second to keep, None keeps every frame.
+        copy (bool): Whether to yield a copy of every frame.
+
+    Yields:
+        (index, timestamp, frame): Index of the extracted frame (frame_%05d is
+        index + 1), its timestamp in seconds and the BGR frame.
+    """
+    width, height, fps = probe_video(video_path)
+    command = ["ffmpeg", "-nostdin", "-v", "error", "-i", video_path, "-an", "-sn"]
+    if rate:
+        command += ["-vf", f"fps={rate}"]
+    command += ["-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"]
+    frame_size = width * height * 3
+    buffer = np.empty((height, width, 3), dtype=np.uint8)
+    view = buffer.data.cast("B")
+    interval = 1.0 / (rate or fps) if (rate or fps) else 0.0
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=frame_size)
+    # A buffered pipe, as bufsize is not 0
+    assert isinstance(process.stdout, io.BufferedReader)
+    index = 0
+    try:
+        while True:
+            with timer("video_decode"):
+                filled = read_exactly(process.stdout, view)
+            if filled < frame_size:
+                break
+            count("bytes_decoded", frame_size)
+            yield index, index * interval, buffer.copy() if copy else buffer
+            index += 1
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            # The consumer stopped early
+            process.kill()
+        process.wait()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def iter_frames(
+    video_path: str,
+    rate: float | None = None,
+    decoder: str = "opencv",
+) -> Iterator[tuple[int, float, np.ndarray]]:
+    """
+    Yields the (index, timestamp, frame) of a video with one of `VIDEO_DECODERS`,
+    see `iter_video_frames` and `iter_ffmpeg_frames`. Frames can be kept.
+    """
+    if decoder == "ffmpeg":
+        return iter_ffmpeg_frames(video_path, rate, copy=True)
+    if decoder == "opencv":
+        return iter_video_frames(video_path, rate)
+    raise ValueError(
+        f"Unknown video decoder '{decoder}', expected one of {', '.join(VIDEO_DECODERS)}",
+    )
@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+import argparse
+import base64
+import glob
+import json
+import os
+import socketserver
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import cv2
+import numpy as np
+import yaml
+
+from scripts.estimate_height import batch_detect_and_estimate
+from scripts.estimate_height import read_camera_parameters
+from scripts.estimate_height import UNDISTORTION_MAPS
+from scripts.lib.backends import BACKENDS
+from scripts.lib.backends import load_backend
+from scripts.lib.microbatch import MicroBatcher
+from scripts.lib.prefetch import read_image
+from scripts.lib.utils import get_config_parser
+from scripts.lib.utils import load_extrinsics
+from scripts.lib.utils import load_yaml_defaults
+
+COMMAND_NAME = "serve-height"
+
+
+class RequestError(ValueError):
+    """Invalid request, answered with a 400 status."""
+
+
+def load_cameras(config_paths: list[str]) -> dict[str, dict]:
+    """
+    Loads the cameras served, identified by the name of their config file
+    (`config/cam1.yaml` is `cam1`), and warms the camera parameters caches.
+
+    Args:
+        config_paths (list[str]): Camera configs with `intrinsics` and `extrinsics` paths.
+
+    Returns:
+        dict: Camera id to the intrinsics path and extrinsics of the samples.
+    """
+    cameras = {}
+    for path in config_paths:
+        with open(path) as file:
+            config = yaml.safe_load(file)
+        camera_id = os.path.splitext(os.path.basename(path))[0]
+        camera = {
+            "intrinsics": config["intrinsics"],
+            **load_extrinsics(config["extrinsics"]),
+        }
+        read_camera_parameters(camera)
+        cameras[camera_id] = camera
+    return cameras
+
+
+class HeightService:
+    """
+    Keeps the model and the cameras resident and micro-batches the requests.
+    Images are decoded by the request threads, the batcher thread only runs the
+    model and the geometry.
+
+    Args:
+        model_name (str): YOLO model path.
+        backend (str): Inference backend running the model.
+        cameras (dict): Camera id to the camera of the samples, see `load_cameras`.
+        max_batch (int): Maximum number of images per model call.
+        max_wait (float): Seconds a batch waits for more requests.
+        simple (bool): Whether to use the pinhole approximation.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        backend: str,
+        cameras: dict[str, dict],
+        max_batch: int = 32,
+        max_wait: float = 0.01,
+        simple: bool = True,
+    ):
+        self.model = load_backend(backend, model_name)
+        # The first call initializes the model lazily, keep it out of the first request
+        self.model([np.zeros((64, 64, 3), dtype=np.uint8)])
+        self.cameras = cameras
+        self.simple = simple
+        self.batcher = MicroBatcher(self.estimate, max_batch, max_wait)
+
+    def estimate(self, requests: list[dict]) -> list[dict]:
+        samples = [dict(self.cameras[request["camera"]]) for request in requests]
+        batch_detect_and_estimate(
+            samples,
+            self.model,
+            self.simple,
+            images=[request["image"] for request in requests],
+        )
+        return [
+            {"camera": request["camera"], "pred_height": sample["pred_height"]}
+            for request, sample in zip(requests, samples)
+        ]
+
+    def parse(self, request: dict, image_bytes: bytes | None = None) -> dict:
+        """
+        Validates a request and decodes its image, given as `image_path`,
+        base64 encoded `image` or raw encoded bytes.
+        """
+        camera = request.get("camera")
+        if camera not in self.cameras:
+            raise RequestError(f"Unknown camera: {camera}")
+        if image_bytes is None and "image" in request:
+            image_bytes = base64.b64decode(request["image"])
+        if image_bytes is not None:
+            image = cv2.imdecode(
+                np.frombuffer(image_bytes, dtype=np.uint8),
+                cv2.IMREAD_COLOR,
+            )
+        elif "image_path" in request:
+            image = read_image(request)
+        else:
+            raise RequestError("A request needs an image_path or an image")
+        if image is None:
+            raise RequestError("Unable to decode the image")
+        return {"camera": camera, "image": image}
+
+    def metrics(self) -> dict:
+        return {**self.batcher.metrics(), "cameras": sorted(self.cameras)}
+
+
+class HeightRequestHandler(BaseHTTPRequestHandler):
+    """
+    `POST /estimate` with a JSON request (or a list of them) holding a `camera`
+    id and an `image_path` or base64 `image`, or with the raw encoded image as
+    body and `?camera=<id>`. `GET /metrics` returns the service metrics.
+    """
+
+    service: HeightService
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/metrics":
+            self.reply(200, self.service.metrics())
+        elif path == "/health":
+            self.reply(200, {"status": "ok"})
+        else:
+            self.reply(404, {"error": f"Unknown path: {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/estimate":
+            self.reply(404, {"error": f"Unknown path: {url.path}"})
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                payload = json.loads(body)
+                requests = payload if isinstance(payload, list) else [payload]
+                parsed = [self.service.parse(request) for request in requests]
+            else:
+                camera = parse_qs(url.query).get("camera", [None])[0]
+                payload = None
+                parsed = [self.service.parse({"camera": camera}, body)]
+        except (RequestError, ValueError, KeyError) as e:
+            self.reply(400, {"error": str(e)})
+            return
+        futures = [self.service.batcher.submit(request) for request in parsed]
+        try:
+            results = [future.result() for future in futures]
+        except Exception as e:
+            self.reply(500, {"error": str(e)})
+            return
+        self.reply(200, results if isinstance(payload, list) else results[0])
+
+    def reply(self, status: int, body: dict | list):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        # Requests are accounted in the metrics, not logged one by one
+        pass
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn,
+    socketserver.UnixStreamServer,
+):
+    daemon_threads = True
+
+
+def serve(
+    model_name: str = "yolov8n.pt",
+    backend: str = "ultralytics",
+    camera_configs: list[str] | None = None,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket_path: str | None = None,
+    max_batch: int = 32,
+    max_wait_ms: float = 10.0,
+    undistort_map_step: float | None = None,
+):
+    """
+    Serves height estimations until interrupted, on localhost or on a Unix socket.
+    Args:
+        model_name (str): YOLO model path
+        backend (str): Inference backend running the model
+        camera_configs (list[str]): Camera configs served, `config/*.yaml` by default
+        host (str): Address to listen on when no socket is given
+        port (int): Port to listen on when no socket is given
+        socket_path (str): Unix socket to listen on
+        max_batch (int): Maximum number of images per model call
+        max_wait_ms (float): Milliseconds a batch waits for more requests
+        undistort_map_step (float): Grid step of the undistortion lookup tables
+    """
+    UNDISTORTION_MAPS.enable(undistort_map_step)
+    cameras = load_cameras(camera_configs or sorted(glob.glob("config/*.yaml")))
+    service = HeightService(model_name, backend, cameras, max_batch, max_wait_ms / 1e3)
+    handler = type("Handler", (HeightRequestHandler,), {"service": service})
+    server: socketserver.BaseServer
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, handler)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        address = f"http://{host}:{port}"
+    print(f"Serving {len(cameras)} cameras ({', '.join(sorted(cameras))}) on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.batcher.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+        print(json.dumps(service.metrics(), indent=2))
+
+
+def register_subparser(
+    subparsers: argparse._SubParsersAction,
+) -> argparse.ArgumentParser:
+    """
+    Registers the 'serve-height' subparser for CLI.
+
+    Args:
+        subparsers (argparse._SubParsersAction): The subparsers object from the main parser.
+    """
+    parser = subparsers.add_parser(
+        COMMAND_NAME,
+        help="Serve height estimations with a resident model.",
+        parents=[get_config_parser()],
+        conflict_handler="resolve",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default="yolov8n.pt",
+        help="YOLO model path, an exported .onnx model for the onnxruntime and opencv backends.",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=list(BACKENDS),
+        default="ultralytics",
+        help="Inference backend running the model.",
+    )
+    parser.add_argument(
+        "--cameras",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Camera configs served, the id of a camera is its file name (default: config/*.yaml).",
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address to listen on.",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Port to listen on.",
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=None,
+        help="Unix socket to listen on instead of --host and --port.",
+    )
+    parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=32,
+        help="Maximum number of images per model call.",
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=10.0,
+        help="Milliseconds a batch waits for more requests.",
+    )
+    parser.add_argument(
+        "--undistort-map-step",
+        type=float,
+        default=None,
+        help="Undistort bbox endpoints with per-camera lookup tables sampled every N pixels.",
+    )
+    parser.set_defaults(
+        func=lambda args: serve(
+            model_name=args.model,
+            backend=args.backend,
+            camera_configs=args.cameras,
+            host=args.host,
+            port=args.port,
+            socket_path=args.socket,
+            max_batch=args.max_batch,
+            max_wait_ms=args.max_wait_ms,
+            undistort_map_step=args.undistort_map_step,
+        ),
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Height Estimation Service")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparser = register_subparser(subparsers)
+    # Load defaults into the subparser if config is given
+    args, _ = parser.parse_known_args()
+    if args.config and args.command:
+        load_yaml_defaults(subparser, args.config)
+    args = parser.parse_args()
+    args.func(args)
@@ -6,6 +6,10 @@ import os
 import cv2
 import numpy as np
 
+from scripts.lib.frame_store import read_frame
+from scripts.lib.frame_store import split_frame_path
+from scripts.lib.profiling import count_file
+from scripts.lib.profiling import timer
 from scripts.lib.utils import get_config_parser
 from scripts.lib.utils import load_camera_parameters
 from scripts.lib.utils import load_yaml_defaults
@@ -23,17 +27,17 @@ def undistort_image(
     Undistorts an image using camera intrinsics.
 
     Args:
-        image_path (str): Path to the distorted image.
+        image_path (str): Path to the distorted image, or `<store>.frames/<frame name>`.
         intrinsics_path (str): Path to the YAML file with camera_matrix and dist_coeffs.
         output_path (str): Path to save the undistorted image.
     """
-    if not os.path.exists(image_path):
+    if split_frame_path(image_path) is None and not os.path.exists(image_path):
         raise FileNotFoundError(f"Image file not found: {image_path}")
     if not os.path.exists(intrinsics_path):
         raise FileNotFoundError(f"Intrinsics file not found: {intrinsics_path}")
 
     # Load image
-    image = cv2.imread(image_path)
+    image = read_frame(image_path)
     if image is None:
         raise ValueError(f"Unable to load image: {image_path}")
     # Convert BGR to RGB for matplotlib
@@ -47,38 +51,41 @@ def undistort_image(
     h, w = image.shape[:2]
 
     # Undistort
-    if not fisheye:
-        new_camera_matrix = cv2.getOptimalNewCameraMatrix(
-            camera_matrix,
-            dist_coeffs,
-            (w, h),
-            0,
-        )[0]
-        undistorted = cv2.undistort(
-            image,
-            camera_matrix,
-            dist_coeffs,
-            None,
-            new_camera_matrix,
-        )
-    else:
-        # Compute optimal new camera matrix for fisheye
-        new_camera_matrix = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(
-            camera_matrix,
-            dist_coeffs,
-            (w, h),
-            np.eye(3),
-            balance=0.0,
-        )
-        undistorted = cv2.fisheye.undistortImage(
-            image,
-            camera_matrix,
-            dist_coeffs,
-            Knew=new_camera_matrix,
-        )
+    with timer("undistortion"):
+        if not fisheye:
+            new_camera_matrix = cv2.getOptimalNewCameraMatrix(
+                camera_matrix,
+                dist_coeffs,
+                (w, h),
+                0,
+            )[0]
+            undistorted = cv2.undistort(
+                image,
+                camera_matrix,
+                dist_coeffs,
+                None,
+                new_camera_matrix,
+            )
+        else:
+            # Compute optimal new camera matrix for fisheye
+            new_camera_matrix = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(
+                camera_matrix,
+                dist_coeffs,
+                (w, h),
+                np.eye(3),
+                balance=0.0,
+            )
+            undistorted = cv2.fisheye.undistortImage(
+                image,
+                camera_matrix,
+                dist_coeffs,
+                Knew=new_camera_matrix,
+            )
     if output_path:
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        cv2.imwrite(output_path, undistorted)
+        with timer("write"):
+            cv2.imwrite(output_path, undistorted)
+        count_file("bytes_written", output_path)
         print(f"Undistorted image saved to: {output_path}")
     return undistorted
 
@@ -100,7 +107,7 @@ def register_subparser(
     )
     parser.add_argument(
         "--distorted-image",
-        help="Path to the distorted input image.",
+        help="Path to the distorted input image, or <store>.frames/<frame name> for a frame of a store.",
     )
     parser.add_argument(
         "--intrinsics",